@@ -15,6 +15,13 @@
 #define PRINT_FPS 1     // Toggles FPS output (1 = print FPS over serial, 0 = disable output)
 #define USE_DHCP 1      // Toggles the use of DHCP or static config
 
+// Run protocol header: |0xFF|version|mode|start high byte|start low byte|r|g|b|...
+// Packets of the legacy |i|r|g|b| protocol that start with 255 are only 4 bytes long.
+#define HEADER_MAGIC 0xFF
+#define PROTOCOL_VERSION 1
+#define HEADER_SIZE 5
+#define MODE_SHOW 0x80  // Set on the last packet of a frame
+
 // Wifi and network settings
 const char *ssid = "YOUR_WIFI_SSID";
 const char *password = "YOUR_WIFI_PASSWORD";
@@ -72,7 +79,7 @@ void setup()
     set_max_power_in_volts_and_milliamps(5, 500);                  // FastLED Power management set at 5V, 500mA
 }
 
-uint8_t N = 0;
+uint16_t N = 0;
 #if PRINT_FPS
 uint16_t fpsCounter = 0;
 uint32_t secondTimer = 0;
@@ -86,18 +93,43 @@ void loop()
     if (packetSize)
     {
         int len = port.read(packetBuffer, BUFFER_LEN);
-        for (int i = 0; i < len; i += 4)
+        bool show = true;
+        if (len >= HEADER_SIZE + 3 && (uint8_t)packetBuffer[0] == HEADER_MAGIC)
+        {
+            // Run protocol: contiguous RGB values starting at a 16-bit offset
+            show = false;
+            if ((uint8_t)packetBuffer[1] == PROTOCOL_VERSION)
+            {
+                show = ((uint8_t)packetBuffer[2] & MODE_SHOW) != 0;
+                N = ((uint8_t)packetBuffer[3] << 8) | (uint8_t)packetBuffer[4];
+                for (int i = HEADER_SIZE; i + 2 < len && N < NUM_LEDS; i += 3, N++)
+                {
+                    pixels[N].r = (uint8_t)packetBuffer[i];
+                    pixels[N].g = (uint8_t)packetBuffer[i + 1];
+                    pixels[N].b = (uint8_t)packetBuffer[i + 2];
+                }
+            }
+        }
+        else
         {
-            packetBuffer[len] = 0;
-            N = packetBuffer[i];
-            pixels[N].r = (uint8_t)packetBuffer[i + 1];
-            pixels[N].g = (uint8_t)packetBuffer[i + 2];
-            pixels[N].b = (uint8_t)packetBuffer[i + 3];
+            // Legacy protocol: |i|r|g|b| for every changed pixel
+            for (int i = 0; i + 3 < len; i += 4)
+            {
+                N = (uint8_t)packetBuffer[i];
+                if (N >= NUM_LEDS)
+                    continue;
+                pixels[N].r = (uint8_t)packetBuffer[i + 1];
+                pixels[N].g = (uint8_t)packetBuffer[i + 2];
+                pixels[N].b = (uint8_t)packetBuffer[i + 3];
+            }
         }
-        FastLED.show();
+        if (show)
+        {
+            FastLED.show();
 #if PRINT_FPS
-        fpsCounter++;
+            fpsCounter++;
 #endif
+        }
     }
 #if PRINT_FPS
     if (millis() - secondTimer >= 1000U)
@@ -2,36 +2,157 @@
 
 import sys
 import argparse
+import time
 from settings import config
-from PyQt4 import QtCore, QtGui
-from gui.ui import UI
 
 """Visualizer to process audio into 1D Color Data for NeoPixel-like LEDs"""
 
 
+def profile_imports():
+    """Times every first import of a module until report_imports() is called
+
+    Returns a dict mapping module names to [cumulative, self] import times in
+    seconds. Cumulative times include the modules imported while importing
+    the module, self times do not. Imports of modules that are already
+    loaded are not recorded, their time counts towards the importing module.
+    """
+    import builtins
+    timings = {}
+    stack = []
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        requested = name
+        if level > 0 and globals and globals.get('__package__'):
+            # Resolve relative imports to absolute module names
+            base = globals['__package__'].rsplit('.', level - 1)[0]
+            name = base + '.' + name if name else base
+        # 'from package import module' loads the submodules of the fromlist
+        targets = [name] + [name + '.' + item for item in fromlist or ()
+                            if item != '*']
+        loaded = [target for target in targets if target in sys.modules]
+        start = time.perf_counter()
+        stack.append(0.0)
+        try:
+            return original_import(requested, globals, locals, fromlist,
+                                   level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            new = [target for target in targets
+                   if target in sys.modules and target not in loaded]
+            if new:
+                if stack:
+                    stack[-1] += elapsed
+                if new[0] == name or len(new) == 1:
+                    key = new[0]
+                else:
+                    key = '{}.{{{} modules}}'.format(name, len(new))
+                t = timings.setdefault(key, [0.0, 0.0])
+                t[0] += elapsed
+                t[1] += elapsed - nested
+            elif stack:
+                # Nothing was loaded, the time belongs to the importer
+                stack[-1] += nested
+
+    def restore():
+        builtins.__import__ = original_import
+
+    builtins.__import__ = timed_import
+    timings[None] = (time.perf_counter(), restore)
+    return timings
+
+
+def report_imports(timings, limit=20):
+    """Stops timing imports and prints the slowest ones"""
+    started, restore = timings.pop(None)
+    restore()
+    print('Startup took {:.0f} ms'.format(
+        (time.perf_counter() - started) * 1000.0))
+    print('{:>10} {:>10}  module'.format('cumul ms', 'self ms'))
+    slowest = sorted(timings.items(), key=lambda t: t[1][0], reverse=True)
+    for name, (cumulative, own) in slowest[:limit]:
+        print('{:10.1f} {:10.1f}  {}'.format(cumulative * 1000.0,
+                                            own * 1000.0, name))
+
+
 def main():
     parser = argparse.ArgumentParser(description='Start visualizer.')
     parser.add_argument("-hl", "--headless", action='store_true',
                         help="run the visualizer headless")
-    parser.add_argument("-m", "--mode", dest="vis_mode",
-                        help="set visualizer mode")
+    parser.add_argument("-m", "--mode", dest="vis_mode", default="spectrum",
+                        help="set visualizer mode (energy, scroll, spectrum)")
+    parser.add_argument("--profile-startup", action='store_true',
+                        help="print the time spent importing each module")
+    parser.add_argument("-r", "--render", metavar="WAV",
+                        help="render a 16-bit WAV file to LED frames and exit")
+    parser.add_argument("-o", "--output", default="frames.led",
+                        help="file the rendered LED frames are written to")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record every frame sent to the LED strip")
+    parser.add_argument("--play", metavar="FILE",
+                        help="play a recording on the LED strip and exit")
+    parser.add_argument("--loop", action='store_true',
+                        help="repeat the recording given with --play")
 
     args = parser.parse_args()
 
-    #if args.headless:
-    #    enable_gui = False
-    #elif args.vis_mode:
-    #    visualizer_mode = args.vis_mode
-
     print(args)
 
-    if not args.headless:
-        app = QtGui.QApplication(sys.argv)
-        window = QtGui.QMainWindow()
-        ui = UI(app)
-        ui.setupUi(window)
-        window.show()
-        sys.exit(app.exec_())
+    timings = profile_imports() if args.profile_startup else None
+
+    if args.play:
+        from output import led
+        from output.recording import FramePlayer
+        player = FramePlayer(args.play)
+        # Open the output device now, so its imports are part of the report
+        led.setup()
+        if timings is not None:
+            report_imports(timings)
+        try:
+            player.play(loop=args.loop)
+        except KeyboardInterrupt:
+            pass
+    elif args.render:
+        from visualizer.offline import render_file
+        if timings is not None:
+            report_imports(timings)
+        try:
+            render_file(args.render, args.output, mode=args.vis_mode)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.headless:
+        from visualizer.headless import HeadlessRunner
+        try:
+            # The runner records, its output stage may run in a child process
+            runner = HeadlessRunner(mode=args.vis_mode, record=args.record)
+        except ValueError as e:
+            parser.error(str(e))
+        if timings is not None:
+            report_imports(timings)
+        runner.run()
+    else:
+        from PyQt4 import QtGui
+        from gui.ui import UI
+        recorder = None
+        if args.record:
+            from output import led
+            from output.recording import FrameRecorder
+            recorder = led.recorder = FrameRecorder(args.record,
+                                                    config.N_PIXELS)
+        try:
+            app = QtGui.QApplication(sys.argv)
+            window = QtGui.QMainWindow()
+            ui = UI(app)
+            ui.setupUi(window)
+            window.show()
+            if timings is not None:
+                report_imports(timings)
+            status = app.exec_()
+        finally:
+            if recorder is not None:
+                recorder.close()
+        sys.exit(status)
 
 if __name__ == "__main__":
     main()
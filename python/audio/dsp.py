@@ -1,53 +1,483 @@
 from __future__ import print_function
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
 import numpy as np
 from settings import config
 from audio import melbank
 
 
+def _smooth(state, value, alpha_rise, alpha_decay, alpha, scratch, rising):
+    """Exponentially smooths ``state`` towards ``value`` in place
+
+    ``alpha``, ``scratch`` and ``rising`` are preallocated arrays with the
+    shape of ``state``. The smoothing factors may be scalars or arrays.
+    """
+    np.greater(value, state, out=rising)
+    np.copyto(alpha, alpha_decay)
+    np.copyto(alpha, alpha_rise, where=rising)
+    np.multiply(alpha, value, out=scratch)
+    np.subtract(1.0, alpha, out=alpha)
+    state *= alpha
+    state += scratch
+
+
 class ExpFilter:
-    """Simple exponential smoothing filter"""
-    def __init__(self, val=0.0, alpha_decay=0.5, alpha_rise=0.5):
-        """Small rise / decay factors = more smoothing"""
+    """Simple exponential smoothing filter
+
+    Array filters own their state and update it in place, so ``value`` is
+    always the same array and is overwritten by every update. Scalar filters
+    are updated with plain Python arithmetic.
+    """
+    def __init__(self, val=0.0, alpha_decay=0.5, alpha_rise=0.5, out=None):
+        """Small rise / decay factors = more smoothing
+
+        ``out`` is an optional float64 array, for example a view into an
+        ExpFilterBank, that holds the state of an array filter.
+        """
         assert 0.0 < alpha_decay < 1.0, 'Invalid decay smoothing factor'
         assert 0.0 < alpha_rise < 1.0, 'Invalid rise smoothing factor'
         self.alpha_decay = alpha_decay
         self.alpha_rise = alpha_rise
-        self.value = val
+        if isinstance(val, (list, np.ndarray, tuple)):
+            if out is None:
+                out = np.empty(np.shape(val))
+            out[...] = val
+            self.value = out
+            self._alpha = np.empty_like(out)
+            self._scratch = np.empty_like(out)
+            self._rising = np.empty(out.shape, dtype=bool)
+        else:
+            self.value = float(val)
 
     def update(self, value):
-        if isinstance(self.value, (list, np.ndarray, tuple)):
-            alpha = value - self.value
-            alpha[alpha > 0.0] = self.alpha_rise
-            alpha[alpha <= 0.0] = self.alpha_decay
-        else:
+        if isinstance(self.value, float):
+            value = float(value)
             alpha = self.alpha_rise if value > self.value else self.alpha_decay
-        self.value = alpha * value + (1.0 - alpha) * self.value
+            self.value = alpha * value + (1.0 - alpha) * self.value
+            return self.value
+        _smooth(self.value, value, self.alpha_rise, self.alpha_decay,
+                self._alpha, self._scratch, self._rising)
+        return self.value
+
+
+class ExpFilterBank:
+    """Exponential smoothing filters that share one contiguous state array
+
+    Every filter of the bank is an ExpFilter whose ``value`` is a view into
+    ``self.value``. The filters can be updated one by one, or all at once
+    with a single call to ``update``. Filters of equal size that smooth the
+    same input can be updated with that input directly.
+
+    Parameters
+    ----------
+    specs : list
+        One ``(val, alpha_decay, alpha_rise)`` tuple per filter, where
+        ``val`` is the initial array value of the filter.
+    """
+    def __init__(self, specs):
+        shapes = [np.shape(val) for val, _, _ in specs]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        offsets = np.concatenate(([0], np.cumsum(sizes))).astype(int)
+        self.value = np.empty(offsets[-1])
+        self.alpha_decay = np.empty(offsets[-1])
+        self.alpha_rise = np.empty(offsets[-1])
+        self.filters = []
+        for (val, decay, rise), shape, start, stop in zip(
+                specs, shapes, offsets[:-1], offsets[1:]):
+            self.alpha_decay[start:stop] = decay
+            self.alpha_rise[start:stop] = rise
+            state = self.value[start:stop].reshape(shape)
+            self.filters.append(ExpFilter(val, decay, rise, out=state))
+        self._alpha = np.empty_like(self.value)
+        self._scratch = np.empty_like(self.value)
+        self._rising = np.empty(self.value.shape, dtype=bool)
+        self._rows = None
+        if len(set(sizes)) == 1:
+            # One row per filter, a single input broadcasts over the rows
+            self._rows = [a.reshape(len(sizes), sizes[0]) for a in (
+                self.value, self.alpha_rise, self.alpha_decay, self._alpha,
+                self._scratch, self._rising)]
+
+    def update(self, value):
+        """Updates every filter at once
+
+        Parameters
+        ----------
+        value : np.array
+            The concatenated, flattened new values of all filters, or, if
+            all filters have the same size, one flattened value that every
+            filter is updated with.
+
+        Returns
+        -------
+        value : np.array
+            The state of all filters, ``self.value``.
+        """
+        if self._rows is not None and np.size(value) != self.value.size:
+            _smooth(self._rows[0], value, *self._rows[1:])
+        else:
+            _smooth(self.value, value, self.alpha_rise, self.alpha_decay,
+                    self._alpha, self._scratch, self._rising)
         return self.value
 
 
+class AudioHistory:
+    """Preallocated ring buffer holding the rolling window of audio samples
+
+    Every sample is stored twice, once in each half of a buffer that is twice
+    as long as the rolling window. The most recent ``n_frames * frame_size``
+    samples are therefore always available as one contiguous,
+    chronologically ordered view and no per-frame shifting or concatenation
+    is needed. Frames of any length up to the window size can be pushed.
+    """
+    def __init__(self, n_frames, frame_size, fill=0.0):
+        self.n_frames = n_frames
+        self.frame_size = frame_size
+        self.size = n_frames * frame_size
+        self._buffer = np.full(2 * self.size, fill, dtype=np.float32)
+        self._pos = 0
+
+    def push(self, frame, scale=1.0):
+        """Writes a new frame of audio, scaled by ``scale``, into the ring"""
+        start = self._pos
+        stop = start + len(frame)
+        if stop <= self.size:
+            np.multiply(frame, scale, out=self._buffer[start:stop],
+                        casting='unsafe')
+            self._buffer[start + self.size:stop + self.size] = \
+                self._buffer[start:stop]
+        else:
+            # The frame wraps around the end of the ring
+            split = self.size - start
+            self.push(frame[:split], scale)
+            self.push(frame[split:], scale)
+            return
+        self._pos = stop % self.size
+
+    def window(self):
+        """Returns a view of the rolling window, oldest sample first"""
+        return self._buffer[self._pos:self._pos + self.size]
+
+    def peak(self):
+        """Returns the largest absolute sample value in the rolling window"""
+        y = self.window()
+        return max(y.max(), -y.min())
+
+
+class SpectralAnalyzer:
+    """Windowed, zero-padded real FFT with all buffers allocated up front
+
+    The padded transform length, the window and the frequency axis are
+    computed once. Every call writes the windowed samples into a zero-padded
+    float64 input buffer and the magnitude spectrum into ``self.magnitude``,
+    which is overwritten on every call. With NumPy 2.0 or later the spectrum
+    is written into a preallocated array as well. scipy.fft, used when
+    ``workers`` is set, cannot write into an existing array and allocates
+    the spectrum on every call.
+    """
+    def __init__(self, rate, n_samples, workers=None):
+        self.rate = rate
+        self.n_samples = n_samples
+        self.workers = workers
+        # Pad with zeros until the next power of two
+        self.n_fft = 2**int(np.ceil(np.log2(n_samples)))
+        self.n_bins = n_samples // 2
+        self.window = np.hamming(n_samples)
+        self.freqs = np.fft.rfftfreq(self.n_fft, 1.0 / rate)[:self.n_bins]
+        self.magnitude = np.zeros(self.n_bins)
+        # float64, which the FFT would otherwise convert to in a temporary
+        self._input = np.zeros(self.n_fft)
+        self._spectrum = np.fft.rfft(self._input)
+        self._scipy_fft = None
+        if workers:
+            try:
+                import scipy.fft
+                self._scipy_fft = scipy.fft
+            except ImportError:
+                pass
+        if self._scipy_fft is not None:
+            self._transform = self._scipy_rfft
+        else:
+            try:
+                np.fft.rfft(self._input, out=self._spectrum)
+                self._transform = self._numpy_rfft
+            except TypeError:
+                # NumPy < 2.0 cannot write into an existing array
+                self._transform = np.fft.rfft
+
+    def _numpy_rfft(self, x):
+        return np.fft.rfft(x, out=self._spectrum)
+
+    def _scipy_rfft(self, x):
+        return self._scipy_fft.rfft(x, workers=self.workers)
+
+    def __call__(self, samples):
+        """Returns the magnitude spectrum of ``samples``
+
+        Parameters
+        ----------
+        samples : np.array
+            Exactly ``n_samples`` time-domain audio samples.
+
+        Returns
+        -------
+        magnitude : np.array
+            The first ``n_bins`` FFT magnitudes of the windowed samples.
+        """
+        # The tail of the input buffer is never written and stays zero.
+        # Copying first converts float32 samples without a temporary buffer
+        head = self._input[:self.n_samples]
+        head[...] = samples
+        head *= self.window
+        spectrum = self._transform(self._input)
+        np.abs(spectrum[:self.n_bins], out=self.magnitude)
+        return self.magnitude
+
+    def batch(self, windows):
+        """Returns the magnitude spectra of many windows of samples at once
+
+        Parameters
+        ----------
+        windows : np.array
+            (n_windows, n_samples) array of time-domain audio samples.
+
+        Returns
+        -------
+        magnitude : np.array
+            (n_windows, n_bins) array of FFT magnitudes.
+        """
+        spectrum = np.fft.rfft(windows * self.window, n=self.n_fft, axis=1)
+        return np.abs(spectrum[:, :self.n_bins])
+
+
+@lru_cache(maxsize=16)
+def _window_function(window, n):
+    w = window(n)
+    w.flags.writeable = False
+    return w
+
+
 def rfft(data, window=None):
-    window = 1.0 if window is None else window(len(data))
+    window = 1.0 if window is None else _window_function(window, len(data))
     ys = np.abs(np.fft.rfft(data * window))
     xs = np.fft.rfftfreq(len(data), 1.0 / config.MIC_RATE)
     return xs, ys
 
 
 def fft(data, window=None):
-    window = 1.0 if window is None else window(len(data))
+    window = 1.0 if window is None else _window_function(window, len(data))
     ys = np.fft.fft(data * window)
     xs = np.fft.fftfreq(len(data), 1.0 / config.MIC_RATE)
     return xs, ys
 
 
-def create_mel_bank():
-    global samples, mel_y, mel_x
-    samples = int(config.MIC_RATE * config.N_ROLLING_HISTORY / (2.0 * config.FPS))
-    mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=config.N_FFT_BINS,
-                                               freq_min=config.MIN_FREQUENCY,
-                                               freq_max=config.MAX_FREQUENCY,
-                                               num_fft_bands=samples,
-                                               sample_rate=config.MIC_RATE)
-samples = None
-mel_y = None
-mel_x = None
-create_mel_bank()
\ No newline at end of file
+@lru_cache(maxsize=32)
+def gaussian_kernel(sigma, truncate=4.0):
+    """Returns the normalized 1-D kernel of a gaussian blur
+
+    The kernel has 2 * int(truncate * sigma + 0.5) + 1 taps, like the one
+    used by scipy.ndimage.gaussian_filter1d. Kernels are cached by sigma.
+    """
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 / float(sigma)**2 * x**2)
+    kernel /= kernel.sum()
+    kernel.flags.writeable = False
+    return kernel
+
+
+@lru_cache(maxsize=32)
+def _reflect_indices(length, radius):
+    """Returns the source index of every sample of a 'reflect' padded row"""
+    # Mirror source indices beyond the edges, as in 'd c b a | a b c d'
+    sources = np.mod(np.arange(-radius, length + radius), 2 * length)
+    sources = np.where(sources >= length, 2 * length - 1 - sources, sources)
+    sources.flags.writeable = False
+    return sources
+
+
+_padded = threading.local()
+"""Padded copies of the blurred arrays, preallocated per thread and shape"""
+
+
+def gaussian_filter1d(x, sigma, out=None):
+    """Blurs the last axis of ``x`` with a gaussian kernel
+
+    Matches scipy.ndimage.gaussian_filter1d with the default 'reflect'
+    mode. ``x`` is mirrored at both ends into a preallocated buffer, and all
+    rows are blurred at once with one dot product of the sliding windows of
+    the buffer and the cached kernel.
+
+    Parameters
+    ----------
+    x : np.array
+        1-D array, or 2-D array of rows that are blurred independently.
+    sigma : float
+        Standard deviation of the gaussian kernel in samples.
+    out : np.array, optional
+        Preallocated C-contiguous float64 array with the shape of ``x`` that
+        receives the result. May be ``x`` itself.
+
+    Returns
+    -------
+    y : np.array
+        The blurred array.
+    """
+    kernel = gaussian_kernel(sigma)
+    sources = _reflect_indices(x.shape[-1], len(kernel) // 2)
+    shape = x.shape[:-1] + sources.shape
+    padded = _padded.__dict__.get(shape)
+    if padded is None:
+        padded = _padded.__dict__[shape] = np.empty(shape)
+    # _reflect_indices() is always in range, mode='clip' lets np.take write
+    # straight into the buffer instead of through a temporary one
+    np.take(x, sources, axis=-1, out=padded, mode='clip')
+    if out is None:
+        out = np.empty(x.shape)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        padded, len(kernel), axis=-1)
+    np.dot(windows, kernel, out=out)
+    return out
+
+
+class SparseMelBank:
+    """Banded representation of a triangular mel filterbank matrix
+
+    Every row of the mel matrix is zero outside of one contiguous run of FFT
+    bins. Only that run is stored: a start index, a length and the weights of
+    each band. All bands are concatenated so the whole filterbank can be
+    applied with one gather, one multiply and one ``np.add.reduceat`` into
+    preallocated arrays. The weights and buffers have the dtype of the FFT
+    magnitude spectrum, so no step casts between dtypes.
+    """
+    def __init__(self, melmat, dtype=np.float64):
+        melmat = np.asarray(melmat, dtype=dtype)
+        self.num_bands, self.num_fft_bands = melmat.shape
+        self.starts = np.zeros(self.num_bands, dtype=np.intp)
+        self.lengths = np.ones(self.num_bands, dtype=np.intp)
+        weights = []
+        for i, row in enumerate(melmat):
+            nonzero = np.flatnonzero(row)
+            if len(nonzero) == 0:
+                # Keep a single zero weight so every band has a slot
+                weights.append(np.zeros(1, dtype=dtype))
+                continue
+            self.starts[i] = nonzero[0]
+            self.lengths[i] = nonzero[-1] - nonzero[0] + 1
+            weights.append(row[nonzero[0]:nonzero[-1] + 1])
+        self.weights = np.concatenate(weights)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)[:-1]))
+        self.indices = np.concatenate([np.arange(s, s + n) for s, n
+                                       in zip(self.starts, self.lengths)])
+        self._scratch = np.zeros_like(self.weights)
+        self.output = np.zeros(self.num_bands, dtype=dtype)
+
+    def __call__(self, ys, out=None):
+        """Applies the filterbank to an FFT magnitude spectrum
+
+        Parameters
+        ----------
+        ys : np.array
+            Magnitude spectrum with ``num_fft_bands`` values, of the dtype
+            the filterbank was built with.
+        out : np.array, optional
+            Array receiving the mel spectrum. Defaults to ``self.output``,
+            which is overwritten on every call.
+
+        Returns
+        -------
+        mel : np.array
+            Mel spectrum with ``num_bands`` values.
+        """
+        out = self.output if out is None else out
+        # The indices are in range by construction. With the default
+        # mode='raise' NumPy would gather through a temporary buffer
+        np.take(ys, self.indices, out=self._scratch, mode='clip')
+        np.multiply(self._scratch, self.weights, out=self._scratch)
+        np.add.reduceat(self._scratch, self.offsets, out=out)
+        return out
+
+
+DSPSnapshot = namedtuple('DSPSnapshot', [
+    'version', 'rate', 'fps', 'n_history', 'n_bins', 'min_frequency',
+    'max_frequency', 'fft_workers', 'samples_per_frame', 'analyzer',
+    'mel_y', 'mel_x', 'mel_bank'])
+"""Immutable DSP settings together with everything derived from them
+
+The settings are copied from the config module when the snapshot is built.
+``analyzer`` is the SpectralAnalyzer for the rolling window, ``mel_y`` the
+read-only mel matrix, ``mel_x`` the mel band center frequencies and
+``mel_bank`` the SparseMelBank applying ``mel_y``. ``version`` increases by
+one with every new snapshot.
+"""
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _build_snapshot(previous):
+    """Builds a snapshot of the config module, reusing what has not changed"""
+    rate, n_history = config.MIC_RATE, config.N_ROLLING_HISTORY
+    samples_per_frame = int(rate / config.FPS)
+    analyzer_key = (rate, samples_per_frame * n_history, config.FFT_WORKERS)
+    if previous is not None and analyzer_key == (
+            previous.rate, previous.analyzer.n_samples, previous.fft_workers):
+        analyzer = previous.analyzer
+    else:
+        analyzer = SpectralAnalyzer(rate, samples_per_frame * n_history,
+                                    workers=config.FFT_WORKERS)
+    mel_key = (config.N_FFT_BINS, config.MIN_FREQUENCY,
+               config.MAX_FREQUENCY, analyzer.n_bins, rate)
+    if previous is not None and mel_key == (
+            previous.n_bins, previous.min_frequency, previous.max_frequency,
+            previous.analyzer.n_bins, previous.rate):
+        mel_y, mel_x = previous.mel_y, previous.mel_x
+        mel_bank = previous.mel_bank
+    else:
+        mel_y, (_, mel_x) = melbank.cached_melmat(
+            config.N_FFT_BINS, config.MIN_FREQUENCY, config.MAX_FREQUENCY,
+            analyzer.n_bins, rate, cache_dir=config.MEL_CACHE_DIR)
+        mel_bank = SparseMelBank(mel_y)
+    return DSPSnapshot(
+        version=0 if previous is None else previous.version + 1,
+        rate=rate, fps=config.FPS, n_history=n_history,
+        n_bins=config.N_FFT_BINS, min_frequency=config.MIN_FREQUENCY,
+        max_frequency=config.MAX_FREQUENCY, fft_workers=config.FFT_WORKERS,
+        samples_per_frame=samples_per_frame, analyzer=analyzer,
+        mel_y=mel_y, mel_x=mel_x, mel_bank=mel_bank)
+
+
+def snapshot():
+    """Returns the current DSPSnapshot, building the first one if needed
+
+    The processing thread takes the snapshot once per frame, so a new
+    configuration takes effect between two frames and never half-way.
+    """
+    current = _snapshot
+    if current is None:
+        current = reconfigure()
+    return current
+
+
+def reconfigure(**settings):
+    """Changes DSP settings and publishes a new snapshot
+
+    Keyword arguments are config module settings, for example
+    ``reconfigure(MIN_FREQUENCY=200, MAX_FREQUENCY=8000)``. The new snapshot
+    is built completely in the calling thread, off the audio hot path, and
+    then replaces the current one in a single assignment.
+
+    Returns
+    -------
+    snapshot : DSPSnapshot
+        The new snapshot.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        for name, value in settings.items():
+            assert hasattr(config, name), 'Unknown setting {}'.format(name)
+            setattr(config, name, value)
+        _snapshot = _build_snapshot(_snapshot)
+        return _snapshot
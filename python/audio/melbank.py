@@ -30,7 +30,11 @@ Functions
 ---------
 """
 
-from numpy import abs, append, arange, insert, linspace, log10, round, zeros
+import os
+from functools import lru_cache
+
+import numpy as np
+from numpy import abs, append, arange, insert, linspace, log10, round
 
 
 def hertz_to_mel(freq):
@@ -134,19 +138,61 @@ def compute_melmat(num_mel_bands=12, freq_min=64, freq_max=8000,
     lower_edges_hz = mel_to_hertz(lower_edges_mel)
     upper_edges_hz = mel_to_hertz(upper_edges_mel)
     freqs = linspace(0.0, sample_rate / 2.0, num_fft_bands)
-    melmat = zeros((num_mel_bands, num_fft_bands))
 
-    for imelband, (center, lower, upper) in enumerate(zip(
-            center_frequencies_hz, lower_edges_hz, upper_edges_hz)):
+    # All bands at once: one row per band, one column per fft band. Each
+    # triangle is the smaller of its two slopes, clipped at zero
+    f = freqs[np.newaxis, :]
+    center = center_frequencies_hz[:, np.newaxis]
+    lower = lower_edges_hz[:, np.newaxis]
+    upper = upper_edges_hz[:, np.newaxis]
+    melmat = np.subtract(f, lower)
+    melmat /= center - lower
+    right_slope = np.subtract(upper, f)
+    right_slope /= upper - center
+    np.minimum(melmat, right_slope, out=melmat)
+    np.maximum(melmat, 0.0, out=melmat)
 
-        left_slope = (freqs >= lower) == (freqs <= center)
-        melmat[imelband, left_slope] = (
-            (freqs[left_slope] - lower) / (center - lower)
-        )
+    return melmat, (center_frequencies_mel, freqs)
 
-        right_slope = (freqs >= center) == (freqs <= upper)
-        melmat[imelband, right_slope] = (
-            (upper - freqs[right_slope]) / (upper - center)
-        )
 
+@lru_cache(maxsize=64)
+def cached_melmat(num_mel_bands, freq_min, freq_max, num_fft_bands,
+                  sample_rate, cache_dir=None):
+    """Returns compute_melmat() for these arguments from a cache
+
+    Results are kept in memory, with the least recently used of the last
+    64 configurations evicted first. If ``cache_dir`` is given, the matrix
+    is also saved there as a .npy file and loaded from it when the same
+    configuration is asked for after a restart. The returned arrays are
+    read-only, because they are shared by every caller.
+    """
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'melmat_{}_{!r}_{!r}_{}_{!r}.npy'.format(
+            num_mel_bands, float(freq_min), float(freq_max), num_fft_bands,
+            float(sample_rate)))
+    melmat = None
+    if path is not None and os.path.exists(path):
+        try:
+            melmat = np.load(path)
+        except (OSError, ValueError):
+            melmat = None
+        if melmat is not None and melmat.shape != (num_mel_bands,
+                                                   num_fft_bands):
+            melmat = None
+    if melmat is None:
+        melmat, (center_frequencies_mel, freqs) = compute_melmat(
+            num_mel_bands, freq_min, freq_max, num_fft_bands, sample_rate)
+        if path is not None:
+            try:
+                np.save(path, melmat)
+            except OSError:
+                pass
+    else:
+        center_frequencies_mel = melfrequencies_mel_filterbank(
+            num_mel_bands, freq_min, freq_max, num_fft_bands)[0]
+        freqs = linspace(0.0, sample_rate / 2.0, num_fft_bands)
+    for array in (melmat, center_frequencies_mel, freqs):
+        array.flags.writeable = False
     return melmat, (center_frequencies_mel, freqs)
+
@@ -1,24 +1,151 @@
 import time
+from collections import deque
+
 import numpy as np
 import pyaudio
+from audio import dsp
 from settings import config
+from visualizer import metrics
 
 import threading
 
 class AudioInputProcess(threading.Thread):
+    """Reads audio from the microphone and passes it to a callback
+
+    Every frame is converted from 16-bit integers to float32 values between
+    -1 and 1 in a single step, straight into a free slot of a preallocated
+    ring of ``ring_size`` frames. The callback receives a view of the slot.
+    The slot is reused as soon as the callback returns, unless the thread
+    is created with ``hold=True``. Then the consumer keeps the slot until it
+    hands it back with release(). A frame that arrives while no slot is free
+    is dropped and counted in ``dropped``.
+
+    With ``mode='blocking'`` the thread reads the stream itself. With
+    ``mode='callback'`` PyAudio delivers the audio from its own thread as
+    soon as the device buffer is full, and this thread only forwards it.
+
+    When a new DSP snapshot changes the frame size, the stream keeps its
+    buffer size and its audio is cut into frames of the new size. Only a new
+    sampling rate makes the thread reopen the stream, between two frames.
+    """
 
     def __init__(self, group=None, target=None, name=None,
                  args=(), kwargs=None):
         super(AudioInputProcess, self).__init__(group=group, target=target,
                                               name=name, args=args)
         self._stop_event = threading.Event()
-        self.kwargs = kwargs
+        self.kwargs = kwargs if kwargs is not None else {}
         self.args=args
+        self.mode = self.kwargs.get('mode', config.CAPTURE_MODE)
+        assert self.mode in ('blocking', 'callback'), \
+            'Unknown capture mode {}'.format(self.mode)
+        self.rate = config.MIC_RATE
+        self.frames_per_buffer = int(config.MIC_RATE / config.FPS)
+        """Number of samples of the frames passed to the callback"""
+        self.stream_buffer = self.frames_per_buffer
+        """Number of samples the stream delivers at once"""
+        self.hold = self.kwargs.get('hold', False)
+        self._ready = threading.Condition()
+        self._filled = deque()
+        self._allocate(self.kwargs.get('ring_size', 4))
+        self._resize_to = self.frames_per_buffer
+        self.latency = 0.0
+        """Time in seconds between the ADC capture and conversion of the
+        latest frame, when the audio driver reports it"""
+        self.overflows = 0
+        self.dropped = 0
+        """Number of frames dropped because every ring slot was held"""
         return
 
+    def _allocate(self, ring_size):
+        self.ring = np.zeros((ring_size, self.frames_per_buffer),
+                             dtype=np.float32)
+        """Preallocated frames of normalized audio samples"""
+        self._slots = list(self.ring)
+        self._slot_of = dict((id(frame), k)
+                             for k, frame in enumerate(self._slots))
+        self._free = deque(range(ring_size))
+        # Audio of a frame that is not complete yet
+        self._stage = np.zeros(self.frames_per_buffer, dtype=np.float32)
+        self._staged = 0
+
     def stop(self, timeout=None):
         """ Stop the thread and wait for it to end. """
         self._stop_event.set()
+        with self._ready:
+            self._ready.notify_all()
+
+    def release(self, frame):
+        """Hands a frame passed to the callback back to the ring"""
+        with self._ready:
+            # Frames of a ring replaced by a new frame size are not reused
+            slot = self._slot_of.get(id(frame))
+            if slot is not None:
+                self._free.append(slot)
+
+    def _take(self):
+        """Returns a free ring slot, or None after counting a dropped frame"""
+        with self._ready:
+            if not self._free:
+                self.dropped += 1
+                return None
+            return self._slots[self._free.popleft()]
+
+    def _convert(self, data, emit):
+        """Converts raw 16-bit audio into frames of frames_per_buffer samples
+
+        Calls ``emit`` with every completed frame. Runs on the thread that
+        receives the audio, which is also the only one to resize the ring.
+        """
+        if self._resize_to != self.frames_per_buffer:
+            with self._ready:
+                self.frames_per_buffer = self._resize_to
+                # Frames already passed on keep the old ring alive
+                self._allocate(len(self.ring))
+        samples = np.frombuffer(data, dtype=np.int16)
+        if self._staged == 0 and len(samples) == self.frames_per_buffer:
+            frame = self._take()
+            if frame is not None:
+                np.multiply(samples, 1.0 / 2.0**15, out=frame,
+                            casting='unsafe')
+                emit(frame)
+            return
+        # The stream buffer and the frames differ in size
+        while len(samples):
+            n = min(len(samples), self.frames_per_buffer - self._staged)
+            np.multiply(samples[:n], 1.0 / 2.0**15,
+                        out=self._stage[self._staged:self._staged + n],
+                        casting='unsafe')
+            self._staged += n
+            samples = samples[n:]
+            if self._staged == self.frames_per_buffer:
+                self._staged = 0
+                frame = self._take()
+                if frame is not None:
+                    np.copyto(frame, self._stage)
+                    emit(frame)
+
+    def _enqueue(self, frame):
+        with self._ready:
+            self._filled.append(frame)
+            self._ready.notify()
+
+    def _deliver(self, callback, frame):
+        callback(frame)
+        if not self.hold:
+            self.release(frame)
+
+    def _on_audio(self, in_data, frame_count, time_info, status_flags):
+        """PyAudio stream callback, runs on the PortAudio thread"""
+        t = metrics.clock()
+        if status_flags & getattr(pyaudio, 'paInputOverflow', 0):
+            self.overflows += 1
+        self._convert(in_data, self._enqueue)
+        metrics.stats.lap('capture', t)
+        adc_time = time_info.get('input_buffer_adc_time', 0.0)
+        if adc_time:
+            self.latency = time_info['current_time'] - adc_time
+        return None, pyaudio.paContinue
 
     def run(self):
         callback = self.args[0]
@@ -27,31 +154,68 @@ class AudioInputProcess(threading.Thread):
         try:
             selected_device = self.args[1]
             update =self.args[2]
-        except:            
+        except:
             selected_device = None
+
+        def deliver(frame):
+            self._deliver(callback, frame)
+            update()
+
         p = pyaudio.PyAudio()
-        frames_per_buffer = int(config.MIC_RATE / config.FPS)
-        stream = p.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=config.MIC_RATE,
-                        input=True,
-                        frames_per_buffer=frames_per_buffer, 
-                        input_device_index=selected_device)
+        stream = None
         overflows = 0
         prev_ovf_time = time.time()
         while not self._stop_event.is_set():
+            state = dsp.snapshot()
+            # Applied by _convert before the next block of audio
+            self._resize_to = state.samples_per_frame
+            if stream is None or self.rate != state.rate:
+                if stream is not None:
+                    stream.stop_stream()
+                    stream.close()
+                stream = self._open(p, state, selected_device)
+            if self.mode == 'callback':
+                with self._ready:
+                    self._ready.wait_for(
+                        lambda: self._filled or self._stop_event.is_set(),
+                        0.5)
+                    filled = list(self._filled)
+                    self._filled.clear()
+                for frame in filled:
+                    deliver(frame)
+                if self.overflows > overflows:
+                    overflows = self.overflows
+                    if time.time() > prev_ovf_time + 1:
+                        prev_ovf_time = time.time()
+                        print('Audio buffer has overflowed {} times'.format(overflows))
+                continue
             try:
-                y = np.fromstring(stream.read(
-                    frames_per_buffer), dtype=np.int16)
-                y = y.astype(np.float32)
-                callback(y)                
-                update()
+                data = stream.read(self.stream_buffer)
+                t = metrics.clock()
+                frames = []
+                self._convert(data, frames.append)
+                metrics.stats.lap('capture', t)
+                for frame in frames:
+                    deliver(frame)
             except IOError:
                 overflows += 1
                 if time.time() > prev_ovf_time + 1:
                     prev_ovf_time = time.time()
                     print('Audio buffer has overflowed {} times'.format(overflows))
-        stream.stop_stream()
-        stream.close()
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
         p.terminate()
 
+    def _open(self, p, state, device):
+        """Opens the input stream for the rate and frame size of ``state``"""
+        self.rate = state.rate
+        self.stream_buffer = state.samples_per_frame
+        stream_callback = self._on_audio if self.mode == 'callback' else None
+        return p.open(format=pyaudio.paInt16,
+                      channels=1,
+                      rate=self.rate,
+                      input=True,
+                      frames_per_buffer=self.stream_buffer,
+                      input_device_index=device,
+                      stream_callback=stream_callback)
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+"""Benchmarks the audio-to-LED pipeline on synthetic audio
+
+Every configuration of the matrix runs in a fresh interpreter, because the
+effects and the Processor size their state from the config module when they
+are imported. For every stage the mean and 99th percentile time per frame
+and the peak memory allocated while processing one frame (as traced by
+tracemalloc) are reported, together with the highest frame rate the
+complete pipeline could sustain on this machine.
+
+Usage:
+    python benchmark.py -o results.json
+    python benchmark.py --pixels 144 300 --compare results.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+EFFECT_NAMES = ('energy', 'scroll', 'spectrum')
+
+
+class _StubSocket:
+    def sendto(self, data, address):
+        return len(data)
+
+
+class _StubStrip:
+    def __init__(self, n_pixels):
+        self._led_data = [0] * n_pixels
+
+    def show(self):
+        pass
+
+
+class _StubStick:
+    def set_led_data(self, channel, data):
+        pass
+
+
+def synthetic_audio(n_frames, samples_per_frame, rate, seed=0):
+    """Returns reproducible frames of a swept tone with beats and noise"""
+    rng = np.random.RandomState(seed)
+    t = np.arange(n_frames * samples_per_frame) / float(rate)
+    tone = np.sin(2 * np.pi * (100 + 2000 * (t % 4.0) / 4.0) * t)
+    beats = 0.5 + 0.5 * np.sign(np.sin(2 * np.pi * 2.0 * t))
+    audio = 0.3 * tone * beats + 0.02 * rng.randn(len(t))
+    return audio.astype(np.float32).reshape(n_frames, samples_per_frame)
+
+
+def measure(function, inputs, warmup=20):
+    """Times ``function`` over every item of ``inputs``
+
+    Returns a dict with the mean and 99th percentile time per call in
+    microseconds and the mean peak memory allocated by one call in bytes.
+    """
+    for x in inputs[:warmup]:
+        function(x)
+    times = np.empty(len(inputs))
+    for k, x in enumerate(inputs):
+        start = time.perf_counter()
+        function(x)
+        times[k] = time.perf_counter() - start
+    # Allocations are traced in a separate pass, tracing slows every call
+    tracemalloc.start()
+    peaks = np.empty(min(len(inputs), 50))
+    for k in range(len(peaks)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        function(inputs[k])
+        peaks[k] = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {
+        'mean_us': float(times.mean() * 1e6),
+        'p99_us': float(np.percentile(times, 99) * 1e6),
+        'alloc_bytes': float(peaks.mean()),
+    }
+
+
+def run_configuration(params, n_frames):
+    """Benchmarks every stage for one configuration, in this interpreter"""
+    from settings import config
+    from settings.constants import DEVICES
+    config.USE_GUI = False
+    config.DISPLAY_FPS = False
+    # Measure one quality level, the scheduler would lower it under load
+    config.ADAPTIVE_QUALITY = False
+    config.DEVICE = DEVICES.ESP8266
+    config.N_PIXELS = params['N_PIXELS']
+    # The legacy protocol addresses at most 256 pixels
+    config.ESP8266_PROTOCOL = 'legacy' if config.N_PIXELS <= 256 else 'auto'
+    config.N_FFT_BINS = params['N_FFT_BINS']
+    config.N_ROLLING_HISTORY = params['N_ROLLING_HISTORY']
+    config.MIC_RATE = params['MIC_RATE']
+
+    from audio import melbank
+    from output import led
+    from visualizer import effects
+    from visualizer.processor import Processor
+
+    class Parent:
+        visualization_effect = effects.create('spectrum')
+
+    parent = Parent()
+    processor = Processor(parent)
+    audio = synthetic_audio(n_frames, processor.samples_per_frame,
+                            config.MIC_RATE)
+    results = {}
+
+    results['melbank'] = measure(
+        lambda x: melbank.compute_melmat(
+            num_mel_bands=config.N_FFT_BINS,
+            freq_min=config.MIN_FREQUENCY, freq_max=config.MAX_FREQUENCY,
+            num_fft_bands=processor.analyzer.n_bins,
+            sample_rate=config.MIC_RATE),
+        list(range(20)), warmup=2)
+
+    # Feed the audio through the front end once to collect stage inputs
+    windows, spectra, mels = [], [], []
+    for frame in audio:
+        processor.y_roll.push(frame)
+        windows.append(processor.y_roll.window().copy())
+        spectra.append(processor.analyzer(windows[-1]).copy())
+        mels.append(processor.state.mel_bank(spectra[-1]).copy())
+    results['fft'] = measure(processor.analyzer, windows)
+    results['mel'] = measure(processor.state.mel_bank, spectra)
+
+    outputs = {}
+    for name in EFFECT_NAMES:
+        effect = effects.create(name)
+        out = np.empty((3, effect.n_pixels))
+        results['effect_' + name] = measure(
+            lambda mel: effect.render(mel, out), mels)
+        outputs[name] = [np.clip(effect(mel), 0, 255).astype(int)
+                         for mel in mels]
+        parent.visualization_effect = effect
+        results['processor_' + name] = measure(processor.process, audio)
+
+    frames = outputs['spectrum']
+    # Measure the table lookup even where the device does its own gamma
+    software_gamma = config.SOFTWARE_GAMMA_CORRECTION
+    config.SOFTWARE_GAMMA_CORRECTION = True
+    results['gamma'] = measure(led.gamma_correct, frames)
+    config.SOFTWARE_GAMMA_CORRECTION = software_gamma
+    led.setup()
+    for controller in led.router.controllers:
+        controller.sock = _StubSocket()
+    results['led_esp8266'] = measure(led._update_esp8266, frames)
+    led.strip = _StubStrip(config.N_PIXELS)
+    results['led_pi'] = measure(led._update_pi, frames)
+    led.stick = _StubStick()
+    results['led_blinkstick'] = measure(led._update_blinkstick, frames)
+
+    # Slowest effect plus the ESP8266 output bounds the sustainable rate
+    frame_us = max(results['processor_' + name]['mean_us']
+                   for name in EFFECT_NAMES)
+    frame_us += results['gamma']['mean_us'] + results['led_esp8266']['mean_us']
+    return {'params': params, 'stages': results,
+            'frame_us': frame_us, 'max_fps': 1e6 / frame_us}
+
+
+def print_results(runs, baseline=None):
+    """Prints a table of stage timings, with speedups against ``baseline``"""
+    previous = {}
+    for run in baseline or []:
+        if 'error' not in run:
+            previous[json.dumps(run['params'], sort_keys=True)] = run
+    for run in runs:
+        print('\n' + ', '.join('{}={}'.format(k, v)
+                               for k, v in sorted(run['params'].items())))
+        if 'error' in run:
+            print('  failed: {}'.format(run['error']))
+            continue
+        old = previous.get(json.dumps(run['params'], sort_keys=True))
+        for stage, r in sorted(run['stages'].items()):
+            line = '  {:22} {:10.1f} us  p99 {:10.1f} us  {:9.0f} B'.format(
+                stage, r['mean_us'], r['p99_us'], r['alloc_bytes'])
+            if old is not None and stage in old['stages']:
+                line += '  {:5.2f}x'.format(
+                    old['stages'][stage]['mean_us'] / r['mean_us'])
+            print(line)
+        print('  {:22} {:10.0f} FPS'.format('max sustainable', run['max_fps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the visualizer.')
+    parser.add_argument('--pixels', type=int, nargs='+', default=[60, 144, 256])
+    parser.add_argument('--bins', type=int, nargs='+', default=[24, 64])
+    parser.add_argument('--history', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--rate', type=int, nargs='+', default=[44100])
+    parser.add_argument('--frames', type=int, default=300,
+                        help='frames of synthetic audio per stage')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        params = json.loads(args.worker)
+        json.dump(run_configuration(params, args.frames), sys.stdout)
+        return
+
+    runs = []
+    for n_pixels, n_bins, history, rate in itertools.product(
+            args.pixels, args.bins, args.history, args.rate):
+        params = {'N_PIXELS': n_pixels, 'N_FFT_BINS': n_bins,
+                  'N_ROLLING_HISTORY': history, 'MIC_RATE': rate}
+        try:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--frames', str(args.frames),
+                 '--worker', json.dumps(params)])
+        except subprocess.CalledProcessError as e:
+            # The traceback went to stderr, the other configurations still run
+            runs.append({'params': params, 'error': 'exit status {}'.format(
+                e.returncode)})
+            continue
+        runs.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['runs']
+    print_results(runs, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': platform.platform(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'runs': runs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
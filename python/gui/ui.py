@@ -5,14 +5,13 @@ import time
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
-from scipy.ndimage.filters import gaussian_filter1d
 
 from audio import dsp
-from audio.microphone import AudioInputProcess
 from gui.gui import Ui_MainWindow
 from output import led
 from settings import config
-from visualizer.effects import energy, scroll, spectrum
+from visualizer import effects
+from visualizer.pipeline import AudioPipeline
 from visualizer.processor import Processor
 import pyaudio
 
@@ -38,12 +37,19 @@ class UI(Ui_MainWindow):
     """
     active_color = '#16dbeb'
     inactive_color = '#FFFFFF'
-    visualization_effect = spectrum  # Visualization effect to display on the LED strip"""
 
     def __init__(self, parent_app):
         self.parent_app = parent_app
-        self.audio_processor = AudioInputProcess(
-            args=(Processor(self), None, self.parent_app.processEvents))
+        # Every effect keeps its state while another one is displayed
+        self.effects = dict((name, effects.create(name))
+                            for name in effects.EFFECTS)
+        self.visualization_effect = self.effects['spectrum']
+        """Visualization effect to display on the LED strip"""
+        self.processor = Processor(self)
+        self.audio_processor = AudioPipeline(self.processor)
+        # Open the output device from the main thread, the Blinkstick backend
+        # installs signal handlers
+        led.setup()
 
     def setupUi(self, MainWindow):
 
@@ -125,6 +131,10 @@ class UI(Ui_MainWindow):
         self.visualizerStartBtn.clicked.connect(self.start_visualizer_click)
         self.visualizerStopBtn.clicked.connect(self.stop_visualizer_click)
         self.parent_app.aboutToQuit.connect(self.closeEvent)
+        # Redraw the plots at GUI_FPS, independent of the audio frame rate
+        self.plot_timer = QtCore.QTimer()
+        self.plot_timer.timeout.connect(self.update_plots)
+        self.plot_timer.start(int(1000 / config.GUI_FPS))
         # AUDIO INPUT DEVICES
         self.getaudiodevices()
         self.soundDeviceSelectBox.currentIndexChanged.connect(
@@ -132,10 +142,23 @@ class UI(Ui_MainWindow):
 
     def inputDeviceChanged(self, index):
         print("selection changed")
-        self.audio_processor.stop()
-        self.audio_processor = AudioInputProcess(
-            args=(Processor(self), index, self.parent_app.processEvents))
-        self.audio_processor.start()
+        # Only the capture stage needs to reopen, the Processor keeps its state
+        self.audio_processor.set_device(index)
+
+    def update_plots(self):
+        """Plots the newest frame of the visualizer, runs on the GUI thread"""
+        frame = self.processor.plots.read()
+        if frame is None:
+            return
+        mel, pixels = frame
+        state = self.processor.state
+        # Plot filterbank output
+        x = np.linspace(state.min_frequency, state.max_frequency, len(mel))
+        self.mel_curve.setData(x=x, y=mel)
+        # Plot the color channels
+        self.r_curve.setData(y=pixels[0])
+        self.g_curve.setData(y=pixels[1])
+        self.b_curve.setData(y=pixels[2])
 
     def getaudiodevices(self):
         p = pyaudio.PyAudio()
@@ -150,35 +173,30 @@ class UI(Ui_MainWindow):
         maxf = self.freq_slider.tickValue(1)**2.0 * (config.MIC_RATE / 2.0)
         t = 'Frequency range: {:.0f} - {:.0f} Hz'.format(minf, maxf)
         self.freq_label.setText(t)
-        config.MIN_FREQUENCY = minf
-        config.MAX_FREQUENCY = maxf
-        dsp.create_mel_bank()
+        # The audio thread switches to the new mel bank on its next frame
+        dsp.reconfigure(MIN_FREQUENCY=minf, MAX_FREQUENCY=maxf)
 
     def energy_click(self, x):
-        self.visualization_effect = energy
+        self.visualization_effect = self.effects['energy']
         self.energy_label.setText('Energy', color=self.active_color)
         self.scroll_label.setText('Scroll', color=self.inactive_color)
         self.spectrum_label.setText('Spectrum', color=self.inactive_color)
 
     def scroll_click(self, x):
-        self.visualization_effect = scroll
+        self.visualization_effect = self.effects['scroll']
         self.energy_label.setText('Energy', color=self.inactive_color)
         self.scroll_label.setText('Scroll', color=self.active_color)
         self.spectrum_label.setText('Spectrum', color=self.inactive_color)
 
     def spectrum_click(self, x):
-        self.visualization_effect = spectrum
+        self.visualization_effect = self.effects['spectrum']
         self.energy_label.setText('Energy', color=self.inactive_color)
         self.scroll_label.setText('Scroll', color=self.inactive_color)
         self.spectrum_label.setText('Spectrum', color=self.active_color)
 
     def start_visualizer_click(self, event):
-        try:
-            self.audio_processor.start()
-        except:
-            self.audio_processor = AudioInputProcess(args=(Processor(
-                self), self.soundDeviceSelectBox.currentIndex(), self.parent_app.processEvents))
-            self.audio_processor.start()
+        self.audio_processor.device = self.soundDeviceSelectBox.currentIndex()
+        self.audio_processor.start()
 
     def stop_visualizer_click(self, event):
         self.audio_processor.stop()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+"""Measures the delay from audio input to UDP packet output
+
+A fake audio source feeds the normal capture, processing and output pipeline
+with silence, interrupted by short tone bursts. The pixels are sent to a
+stand-in ESP8266 on the loopback interface. The latency of a burst is the
+time from the capture of its first sample to the first packet that lights
+the strip. Every configuration runs in a fresh interpreter.
+
+Usage:
+    python latency.py --fps 30 60 --history 2 4 --effect spectrum scroll
+    python latency.py --max-p50 40   # exits with status 1 when too slow
+"""
+from __future__ import division, print_function
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+class FakeAudioSource(threading.Thread):
+    """Capture thread that delivers silence and tone bursts in real time
+
+    Constructed like an AudioInputProcess. Each frame is delivered one frame
+    period after its first sample, like a device buffer filling up. The
+    capture time of the first sample of every burst is kept in
+    ``burst_times``.
+    """
+    burst_times = []
+
+    def __init__(self, group=None, target=None, name=None,
+                 args=(), kwargs=None):
+        super(FakeAudioSource, self).__init__(name='fake audio')
+        from settings import config
+        self.callback = args[0]
+        self.kwargs = kwargs or {}
+        self.period = 1.0 / config.FPS
+        self.frames_per_buffer = int(config.MIC_RATE / config.FPS)
+        t = np.arange(self.frames_per_buffer) / float(config.MIC_RATE)
+        self.burst = (0.5 * np.sin(2 * np.pi * 1000.0 * t)).astype(np.float32)
+        self.silence = np.zeros(self.frames_per_buffer, dtype=np.float32)
+        self.burst_frames = self.kwargs.get('burst_frames', 3)
+        self.gap_frames = self.kwargs.get('gap_frames', config.FPS // 2)
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+
+    def release(self, frame):
+        pass
+
+    def run(self):
+        cycle = self.burst_frames + self.gap_frames
+        start = time.perf_counter()
+        k = 0
+        while not self._stop_event.is_set():
+            delay = start + (k + 1) * self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            in_burst = k % cycle >= self.gap_frames
+            if k % cycle == self.gap_frames:
+                self.burst_times.append(start + k * self.period)
+            self.callback(self.burst if in_burst else self.silence)
+            k += 1
+
+
+def measure_configuration(params, duration):
+    """Runs one configuration in this interpreter and returns the latencies"""
+    from settings import config
+    from settings.constants import DEVICES
+    config.USE_GUI = False
+    config.DISPLAY_FPS = False
+    # Measure one quality level, the scheduler would lower it under load
+    config.ADAPTIVE_QUALITY = False
+    config.DEVICE = DEVICES.ESP8266
+    config.CONTROLLERS = None
+    config.FPS = params['FPS']
+    config.N_ROLLING_HISTORY = params['N_ROLLING_HISTORY']
+
+    from output import led
+    from output.esp8266 import StandInESP8266, decode
+    from visualizer import effects
+    from visualizer.pipeline import AudioPipeline
+    from visualizer.processor import Processor
+
+    stand_in = StandInESP8266(config.N_PIXELS)
+    config.UDP_IP, config.UDP_PORT = stand_in.address
+    led.setup()
+
+    lit_times = []
+    stop = threading.Event()
+
+    def receive():
+        lit = False
+        stand_in.sock.settimeout(0.1)
+        while not stop.is_set():
+            try:
+                packet = stand_in.sock.recv(2048)
+            except Exception:
+                continue
+            now = time.perf_counter()
+            decode(packet, stand_in.pixels)
+            is_lit = bool(stand_in.pixels.any())
+            if is_lit and not lit:
+                lit_times.append(now)
+            lit = is_lit
+
+    class Parent:
+        visualization_effect = effects.create(params['effect'])
+
+    FakeAudioSource.burst_times = []
+    pipeline = AudioPipeline(Processor(Parent()), source=FakeAudioSource)
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    # The Processor reports every silent frame, keep the output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.start()
+        time.sleep(duration)
+        pipeline.stop(timeout=1.0)
+    stop.set()
+    receiver.join()
+    stand_in.close()
+
+    # Match every burst with the first time the strip lit up after it
+    latencies = []
+    lit_times = np.array(lit_times)
+    for burst_time in FakeAudioSource.burst_times:
+        after = lit_times[lit_times >= burst_time]
+        if len(after):
+            latencies.append((after[0] - burst_time) * 1000.0)
+    return {'params': params, 'latency_ms': latencies,
+            'bursts': len(FakeAudioSource.burst_times),
+            'pipeline': pipeline.stats()}
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'min': float('nan'), 'p50': float('nan'),
+                'p90': float('nan'), 'p99': float('nan'), 'max': float('nan')}
+    p = np.percentile(latencies, [0, 50, 90, 99, 100])
+    return dict(zip(('min', 'p50', 'p90', 'p99', 'max'), map(float, p)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure audio-in to packet-out latency.')
+    parser.add_argument('--fps', type=int, nargs='+', default=[60])
+    parser.add_argument('--history', type=int, nargs='+', default=[2])
+    parser.add_argument('--effect', nargs='+',
+                        default=['energy', 'scroll', 'spectrum'])
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to measure each configuration')
+    parser.add_argument('--max-p50', type=float,
+                        help='fail when a median latency exceeds this (ms)')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        params = json.loads(args.worker)
+        json.dump(measure_configuration(params, args.duration), sys.stdout)
+        return
+
+    runs = []
+    failed = False
+    print('{:>4} {:>8} {:>9}  {:>7} {:>7} {:>7} {:>7} {:>7}  bursts'.format(
+        'FPS', 'history', 'effect', 'min', 'p50', 'p90', 'p99', 'max'))
+    for fps, history, effect in itertools.product(args.fps, args.history,
+                                                  args.effect):
+        params = {'FPS': fps, 'N_ROLLING_HISTORY': history, 'effect': effect}
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--duration', str(args.duration),
+             '--worker', json.dumps(params)])
+        run = json.loads(output.decode('utf-8').splitlines()[-1])
+        run['summary'] = summarize(run['latency_ms'])
+        runs.append(run)
+        s = run['summary']
+        print('{:4d} {:8d} {:>9}  {:7.1f} {:7.1f} {:7.1f} {:7.1f} {:7.1f}  '
+              '{}/{}'.format(fps, history, effect, s['min'], s['p50'],
+                             s['p90'], s['p99'], s['max'],
+                             len(run['latency_ms']), run['bursts']))
+        if args.max_p50 is not None and not s['p50'] <= args.max_p50:
+            failed = True
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': runs}, f, indent=2)
+    if failed:
+        print('Median latency above {} ms'.format(args.max_p50))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
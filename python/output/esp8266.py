@@ -0,0 +1,311 @@
+from __future__ import division, print_function
+
+import socket
+
+import numpy as np
+
+MAX_PIXELS_PER_PACKET = 126
+"""Maximum number of |i|r|g|b| pixel updates sent in a single UDP packet"""
+
+MAX_PIXELS = 256
+"""Largest strip that can be addressed with a one byte pixel index"""
+
+PACKET_DTYPE = np.dtype([('i', np.uint8), ('r', np.uint8),
+                         ('g', np.uint8), ('b', np.uint8)])
+"""Wire layout of a single pixel update in the legacy protocol"""
+
+HEADER_MAGIC = 0xFF
+"""First byte of every packet of the run protocol"""
+
+PROTOCOL_VERSION = 1
+"""Version of the run protocol, second byte of every packet"""
+
+MODE_RUN = 0x01
+"""Packet holds a contiguous run of changed pixels"""
+
+MODE_FRAME = 0x02
+"""Packet holds a chunk of a full frame"""
+
+MODE_SHOW = 0x80
+"""Set on the last packet of a frame, the strip is refreshed after it"""
+
+HEADER_SIZE = 5
+"""|magic|version|mode|start (16 bit, big endian)|"""
+
+MAX_RUN_PIXELS = (1024 - HEADER_SIZE) // 3
+"""Most pixels per run packet, limited by BUFFER_LEN in the firmware"""
+
+RUN_GAP = 10
+"""Unchanged pixels resent rather than starting a new run packet
+
+Resending a pixel costs 3 bytes, a new packet costs a header plus roughly
+28 bytes of IP and UDP headers.
+"""
+
+UDP_OVERHEAD = 28
+"""Bytes of IPv4 and UDP headers added to every packet"""
+
+def packet_bounds(n_changed):
+    """Returns the (start, stop) pixel ranges of each packet of a frame
+
+    Changed pixels are spread as evenly as possible over the smallest
+    number of packets, the same way np.array_split distributes them. A
+    frame without changes still produces one empty packet.
+    """
+    n_packets = n_changed // MAX_PIXELS_PER_PACKET + 1
+    size, extra = divmod(n_changed, n_packets)
+    bounds = []
+    start = 0
+    for k in range(n_packets):
+        stop = start + size + (1 if k < extra else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def encode_header(buffer, offset, mode, start):
+    """Writes a run protocol header into ``buffer`` at ``offset``"""
+    buffer[offset] = HEADER_MAGIC
+    buffer[offset + 1] = PROTOCOL_VERSION
+    buffer[offset + 2] = mode
+    buffer[offset + 3] = start >> 8
+    buffer[offset + 4] = start & 0xFF
+
+
+def decode(packet, pixels):
+    """Applies one packet to ``pixels`` the same way the firmware does
+
+    Parameters
+    ----------
+    packet : bytes
+        Packet in either the legacy |i|r|g|b| or the run protocol format.
+        Legacy packets are at most 4 bytes long when they start with 255,
+        so packets of 8 bytes or more starting with HEADER_MAGIC are run
+        protocol packets.
+    pixels : np.array
+        (3, n_pixels) array that is updated in place.
+
+    Returns
+    -------
+    show : bool
+        Whether the firmware refreshes the strip after this packet.
+    """
+    n_pixels = pixels.shape[1]
+    data = np.frombuffer(packet, dtype=np.uint8)
+    if len(data) >= HEADER_SIZE + 3 and data[0] == HEADER_MAGIC:
+        if data[1] != PROTOCOL_VERSION:
+            return False
+        start = (int(data[3]) << 8) | int(data[4])
+        rgb = data[HEADER_SIZE:]
+        rgb = rgb[:len(rgb) - len(rgb) % 3].reshape(-1, 3)
+        stop = min(start + len(rgb), n_pixels)
+        if start < stop:
+            pixels[:, start:stop] = rgb[:stop - start].T
+        return bool(data[2] & MODE_SHOW)
+    for i in range(0, len(data) - 3, 4):
+        if data[i] < n_pixels:
+            pixels[:, data[i]] = data[i + 1:i + 4]
+    return True
+
+
+class ESP8266Controller:
+    """One ESP8266 driving a contiguous range of the rendered pixels
+
+    Each controller owns a non-blocking UDP socket, the preallocated packet
+    payload and the pixel values it last sent, so only pixels that changed
+    since the previous frame are transmitted.
+
+    Two packet formats are supported. The legacy format is
+        |i|r|g|b|
+    where
+        i (0 to 255): Index of LED to change (zero-based, local to the
+                      controller)
+        r (0 to 255): Red value of LED
+        g (0 to 255): Green value of LED
+        b (0 to 255): Blue value of LED
+    and it is repeated for every changed pixel.
+
+    The run protocol format is
+        |0xFF|version|mode|start|r|g|b|r|g|b|...
+    where start is the 16-bit big endian index of the first pixel of a
+    contiguous run of RGB values. Runs either cover the changed pixels
+    (MODE_RUN) or the whole strip (MODE_FRAME). MODE_SHOW is set on the
+    last packet of a frame.
+
+    With ``protocol='auto'`` the encoding that puts the fewest bytes on the
+    wire is picked for every frame. ``protocol='legacy'`` keeps the
+    original format for controllers running older firmware.
+    """
+    def __init__(self, ip, port, n_pixels, first_pixel=0, sock=None,
+                 protocol='legacy'):
+        assert protocol in ('legacy', 'auto'), \
+            'Unknown ESP8266 protocol {}'.format(protocol)
+        assert protocol == 'auto' or n_pixels <= MAX_PIXELS, \
+            'The legacy protocol supports at most {} pixels'.format(MAX_PIXELS)
+        assert n_pixels < 2**16, 'Too many pixels for one controller'
+        self.address = (ip, port)
+        self.n_pixels = n_pixels
+        self.first_pixel = first_pixel
+        self.last_pixel = first_pixel + n_pixels
+        self.protocol = protocol
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+        self.sock = sock
+        self.prev_pixels = np.tile(253, (3, n_pixels))
+        """Pixel values that were most recently sent to the controller"""
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        # Every changed pixel in its own run is the largest possible frame
+        self._buffer = bytearray((HEADER_SIZE + 3) * n_pixels)
+        self._bytes = np.frombuffer(self._buffer, dtype=np.uint8)
+        self._packet = np.frombuffer(self._buffer, dtype=PACKET_DTYPE,
+                                     count=n_pixels)
+        self._view = memoryview(self._buffer)
+
+    def _encode_legacy(self, p, idx):
+        n = len(idx)
+        self._packet['i'][:n] = idx
+        self._packet['r'][:n] = p[0, idx]
+        self._packet['g'][:n] = p[1, idx]
+        self._packet['b'][:n] = p[2, idx]
+        size = PACKET_DTYPE.itemsize
+        return [(self._view[start * size:stop * size], idx[start:stop])
+                for start, stop in packet_bounds(n)]
+
+    def _encode_runs(self, p, runs, mode):
+        packets = []
+        offset = 0
+        for k, (start, stop) in enumerate(runs):
+            flags = mode | MODE_SHOW if k == len(runs) - 1 else mode
+            encode_header(self._bytes, offset, flags, start)
+            end = offset + HEADER_SIZE + 3 * (stop - start)
+            rgb = self._bytes[offset + HEADER_SIZE:end].reshape(-1, 3)
+            rgb[:] = p[:, start:stop].T
+            packets.append((self._view[offset:end], slice(start, stop)))
+            offset = end
+        return packets
+
+    def _changed_runs(self, idx):
+        """Groups changed pixel indices into runs of at most MAX_RUN_PIXELS"""
+        breaks = np.flatnonzero(np.diff(idx) > RUN_GAP + 1)
+        starts = idx[np.r_[0, breaks + 1]]
+        stops = idx[np.r_[breaks, len(idx) - 1]] + 1
+        runs = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            for s in range(start, stop, MAX_RUN_PIXELS):
+                runs.append((s, min(s + MAX_RUN_PIXELS, stop)))
+        return runs
+
+    @staticmethod
+    def _runs_cost(runs):
+        return sum(UDP_OVERHEAD + HEADER_SIZE + 3 * (stop - start)
+                   for start, stop in runs)
+
+    def encode(self, p):
+        """Encodes the changed pixels of ``p`` and returns the packets
+
+        Parameters
+        ----------
+        p : np.array
+            (3, n) array of final, gamma corrected pixel values. Frames
+            narrower than the strip leave the remaining pixels untouched.
+
+        Returns
+        -------
+        packets : list of (memoryview, index)
+            Payload of every packet together with the pixel indices it
+            updates (an index array or a slice). The payloads are views into
+            a buffer that is reused by the next call.
+        """
+        width = p.shape[1]
+        prev_pixels = self.prev_pixels[:, :width]
+        idx = np.flatnonzero((p != prev_pixels).any(axis=0))
+        prev_pixels[:] = p
+        if self.protocol == 'legacy':
+            return self._encode_legacy(p, idx)
+        if len(idx) == 0:
+            return []
+        runs = self._changed_runs(idx)
+        cost = self._runs_cost(runs)
+        frame_runs = [(start, min(start + MAX_RUN_PIXELS, width))
+                      for start in range(0, width, MAX_RUN_PIXELS)]
+        frame_cost = self._runs_cost(frame_runs)
+        if self.n_pixels <= MAX_PIXELS:
+            n_packets = len(packet_bounds(len(idx)))
+            legacy_cost = 4 * len(idx) + UDP_OVERHEAD * n_packets
+            if legacy_cost <= min(cost, frame_cost):
+                return self._encode_legacy(p, idx)
+        if frame_cost <= cost:
+            return self._encode_runs(p, frame_runs, MODE_FRAME)
+        return self._encode_runs(p, runs, MODE_RUN)
+
+    def send(self, p):
+        """Sends the pixels of ``p`` that changed since the last frame
+
+        The socket never blocks. Pixels of packets that could not be sent,
+        because the socket buffer is full or the network is unreachable, are
+        marked as stale so they are sent again with the next frame.
+        """
+        for payload, idx in self.encode(p):
+            try:
+                self.sock.sendto(payload, self.address)
+                self.packets_sent += 1
+            except OSError:
+                self.packets_dropped += 1
+                self.prev_pixels[:, idx] = -1
+
+
+class StandInESP8266:
+    """Local UDP receiver that decodes packets like the firmware does
+
+    Used to exercise the output path without hardware. Point a controller
+    at ``address`` and call ``receive`` to apply the pending packets.
+    """
+    def __init__(self, n_pixels, ip='127.0.0.1', port=0):
+        self.pixels = np.zeros((3, n_pixels), dtype=np.uint8)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        self.address = self.sock.getsockname()
+        self.packets = 0
+        self.bytes = 0
+        self.shows = 0
+
+    def receive(self, timeout=0.0):
+        """Decodes all pending packets, waiting up to ``timeout`` seconds
+
+        Returns the number of packets received.
+        """
+        n = 0
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                packet = self.sock.recv(2048)
+                self.sock.settimeout(0.0)
+                n += 1
+                self.bytes += len(packet)
+                if decode(packet, self.pixels):
+                    self.shows += 1
+        except (socket.timeout, BlockingIOError):
+            pass
+        self.packets += n
+        return n
+
+    def close(self):
+        self.sock.close()
+
+
+# Execute this file to run a stand-in ESP8266 on the local machine
+# Set UDP_IP in config.py to 127.0.0.1 to send the visualization to it
+if __name__ == '__main__':
+    import time
+    from settings import config
+    stand_in = StandInESP8266(config.N_PIXELS, ip='127.0.0.1',
+                              port=config.UDP_PORT)
+    print('Stand-in ESP8266 listening on {}:{}'.format(*stand_in.address))
+    while True:
+        time.sleep(1.0)
+        shows = stand_in.shows
+        stand_in.receive()
+        print('FPS: {} ({} bytes)'.format(stand_in.shows - shows,
+                                          stand_in.bytes))
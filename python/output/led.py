@@ -1,108 +1,115 @@
 from __future__ import division, print_function
 
-import platform
-
 import numpy as np
 
 from settings import config
 from settings.constants import DEVICES
+from visualizer import metrics
 
-# ESP8266 uses WiFi communication
-if config.DEVICE == DEVICES.ESP8266:
-    import socket
-    _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-# Raspberry Pi controls the LED strip directly
-elif config.DEVICE == DEVICES.PI:
-    import neopixel
-    strip = neopixel.Adafruit_NeoPixel(config.N_PIXELS, config.LED_PIN,
-                                       config.LED_FREQ_HZ, config.LED_DMA,
-                                       config.LED_INVERT, config.BRIGHTNESS)
-    strip.begin()
-elif config.DEVICE == DEVICES.BLINKSTICK:
-    from blinkstick import blinkstick
-    import signal
-    import sys
-    #Will turn all leds off when invoked.
-    def signal_handler(signal, frame):
-        all_off = [0]*(config.N_PIXELS*3)
-        stick.set_led_data(0, all_off)
-        sys.exit(0)
-
-    stick = blinkstick.find_first()
-    # Create a listener that turns the leds off when the program terminates
-    signal.signal(signal.SIGTERM, signal_handler)
-    signal.signal(signal.SIGINT, signal_handler)
-
-_gamma = np.load(config.GAMMA_TABLE_PATH)
+router = None
+"""Output router for the ESP8266 controllers"""
+
+strip = None
+"""Raspberry Pi LED strip driven by rpi_ws281x"""
+
+stick = None
+"""Blinkstick device"""
+
+_gamma = None
 """Gamma lookup table used for nonlinear brightness correction"""
 
+
+def _blinkstick_signal_handler(signal, frame):
+    """Turns all LEDs off when the program terminates"""
+    import sys
+    all_off = [0]*(config.N_PIXELS*3)
+    stick.set_led_data(0, all_off)
+    sys.exit(0)
+
+
+_ready = False
+"""Whether setup() has initialized the output device"""
+
+
+def setup():
+    """Initializes the selected output device
+
+    Only the backend selected by config.DEVICE is imported, so importing this
+    module is cheap. update() calls this automatically the first time, but
+    callers that send frames from another thread must call it from the main
+    thread first, because the Blinkstick backend installs signal handlers.
+    """
+    global router, strip, stick, _ready
+    # ESP8266 uses WiFi communication
+    if config.DEVICE == DEVICES.ESP8266:
+        from output.router import OutputRouter
+        router = OutputRouter.from_config()
+    # Raspberry Pi controls the LED strip directly
+    elif config.DEVICE == DEVICES.PI:
+        import neopixel
+        strip = neopixel.Adafruit_NeoPixel(config.N_PIXELS, config.LED_PIN,
+                                           config.LED_FREQ_HZ, config.LED_DMA,
+                                           config.LED_INVERT, config.BRIGHTNESS)
+        strip.begin()
+    elif config.DEVICE == DEVICES.BLINKSTICK:
+        from blinkstick import blinkstick
+        import signal
+        stick = blinkstick.find_first()
+        # Create a listener that turns the leds off when the program terminates
+        signal.signal(signal.SIGTERM, _blinkstick_signal_handler)
+        signal.signal(signal.SIGINT, _blinkstick_signal_handler)
+    else:
+        raise ValueError('Invalid device selected')
+    _ready = True
+
+
 _prev_pixels = np.tile(253, (3, config.N_PIXELS))
-"""Pixel values that were most recently displayed on the LED strip"""
+"""Pixel values that were most recently displayed on the LED strip (Pi)"""
 
 pixels = np.tile(1, (3, config.N_PIXELS))
 """Pixel values for the LED strip"""
 
-_is_python_2 = int(platform.python_version_tuple()[0]) == 2
+recorder = None
+"""Optional FrameRecorder receiving every frame sent to the LED strip"""
 
-def _update_esp8266():
-    """Sends UDP packets to ESP8266 to update LED strip values
 
-    The ESP8266 will receive and decode the packets to determine what values
-    to display on the LED strip. The communication protocol supports LED strips
-    with a maximum of 256 LEDs.
+def gamma_correct(values):
+    """Returns the final pixel values the LED strip displays for ``values``
 
-    The packet encoding scheme is:
-        |i|r|g|b|
-    where
-        i (0 to 255): Index of LED to change (zero-based)
-        r (0 to 255): Red value of LED
-        g (0 to 255): Green value of LED
-        b (0 to 255): Blue value of LED
+    ``values`` must be integers between 0 and 255. They are gamma corrected
+    when config.SOFTWARE_GAMMA_CORRECTION is set.
     """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optionally apply gamma correc tio
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    MAX_PIXELS_PER_PACKET = 126
-    # Pixel indices
-    idx = range(pixels.shape[1])
-    idx = [i for i in idx if not np.array_equal(p[:, i], _prev_pixels[:, i])]
-    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
-    idx = np.array_split(idx, n_packets)
-    for packet_indices in idx:
-        m = '' if _is_python_2 else []
-        for i in packet_indices:
-            if _is_python_2:
-                m += chr(i) + chr(p[0][i]) + chr(p[1][i]) + chr(p[2][i])
-            else:
-                m.append(i)  # Index of pixel to change
-                m.append(p[0][i])  # Pixel red value
-                m.append(p[1][i])  # Pixel green value
-                m.append(p[2][i])  # Pixel blue value
-        m = m if _is_python_2 else bytes(m)
-        _sock.sendto(m, (config.UDP_IP, config.UDP_PORT))
-    _prev_pixels = np.copy(p)
+    global _gamma
+    if _gamma is None:
+        _gamma = np.load(config.GAMMA_TABLE_PATH)
+    return _gamma[values] if config.SOFTWARE_GAMMA_CORRECTION else values
+
+
+def _update_esp8266(p):
+    """Sends UDP packets to the ESP8266 controllers to update LED strip values
+
+    The frame is split between the controllers configured in
+    config.CONTROLLERS, each of which receives the pixels of its range that
+    changed since the previous frame. See output.esp8266 for the packet
+    encoding.
+    """
+    router.send(p)
 
 
-def _update_pi():
+def _update_pi(p):
     """Writes new LED values to the Raspberry Pi's LED strip
 
     Raspberry Pi uses the rpi_ws281x to control the LED strip directly.
     This function updates the LED strip with new values.
     """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
+    global _prev_pixels
     # Encode 24-bit LED values in 32 bit integers
     r = np.left_shift(p[0][:].astype(int), 8)
     g = np.left_shift(p[1][:].astype(int), 16)
     b = p[2][:].astype(int)
     rgb = np.bitwise_or(np.bitwise_or(r, g), b)
     # Update the pixels
-    for i in range(config.N_PIXELS):
+    for i in range(p.shape[1]):
         # Ignore pixels if they haven't changed (saves bandwidth)
         if np.array_equal(p[:, i], _prev_pixels[:, i]):
             continue
@@ -110,25 +117,19 @@ def _update_pi():
     _prev_pixels = np.copy(p)
     strip.show()
 
-def _update_blinkstick():
+def _update_blinkstick(p):
     """Writes new LED values to the Blinkstick.
         This function updates the LED strip with new values.
     """
-    global pixels
-    
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
     # Read the rgb values
     r = p[0][:].astype(int)
     g = p[1][:].astype(int)
     b = p[2][:].astype(int)
 
     #create array in which we will store the led states
-    newstrip = [None]*(config.N_PIXELS*3)
+    newstrip = [0]*(config.N_PIXELS*3)
 
-    for i in range(config.N_PIXELS):
+    for i in range(p.shape[1]):
         # blinkstick uses GRB format
         newstrip[i*3] = g[i]
         newstrip[i*3+1] = r[i]
@@ -137,18 +138,41 @@ def _update_blinkstick():
     stick.set_led_data(0, newstrip)
 
 
-def update():
-    """Updates the LED strip values"""
+def write(p):
+    """Sends final, already gamma corrected pixel values to the LED strip
+
+    Parameters
+    ----------
+    p : np.array
+        (3, n) array of integer pixel values between 0 and 255.
+    """
+    if not _ready:
+        setup()
+    if recorder is not None:
+        recorder.write(p)
     if config.DEVICE == DEVICES.ESP8266:
-        _update_esp8266()
+        _update_esp8266(p)
     elif config.DEVICE == DEVICES.PI:
-        _update_pi()
+        _update_pi(p)
     elif config.DEVICE == DEVICES.BLINKSTICK:
-        _update_blinkstick()
+        _update_blinkstick(p)
     else:
         raise ValueError('Invalid device selected')
 
 
+def update():
+    """Updates the LED strip values"""
+    global pixels
+    t = metrics.clock()
+    # Truncate values and cast to integer
+    pixels = np.clip(pixels, 0, 255).astype(int)
+    # Optionally apply gamma correction
+    p = gamma_correct(pixels)
+    t = metrics.stats.lap('gamma', t)
+    write(p)
+    metrics.stats.lap('send', t)
+
+
 # Execute this file to run a LED strand test
 # If everything is working, you should see a red, green, and blue pixel scroll
 # across the LED strip continously
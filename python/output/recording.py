@@ -0,0 +1,142 @@
+from __future__ import division, print_function
+
+import os
+import time
+
+import numpy as np
+
+MAGIC = b'LEDREC'
+"""First bytes of every recording"""
+
+VERSION = 1
+"""Version of the recording format"""
+
+HEADER_DTYPE = np.dtype([('magic', 'S6'), ('version', '<u2'),
+                         ('n_pixels', '<u4'), ('reserved', '<u4')])
+"""16 byte file header"""
+
+
+def record_dtype(n_pixels):
+    """Returns the fixed-stride layout of one recorded frame
+
+    Every frame is a little endian float64 timestamp in seconds followed by
+    the final (gamma corrected) red, green and blue values of every pixel.
+    """
+    return np.dtype([('time', '<f8'), ('pixels', np.uint8, (3, n_pixels))])
+
+
+class FrameRecorder:
+    """Appends LED frames and their timestamps to a recording file
+
+    Set ``output.led.recorder`` to a FrameRecorder to record everything that
+    is sent to the LED strip. Frames narrower than the recording are padded
+    with black pixels. Unless ``append`` is False, frames are added to the
+    end of an existing recording.
+    """
+    def __init__(self, path, n_pixels, append=True):
+        self.path = path
+        self.n_pixels = n_pixels
+        self.frames = 0
+        self._file = open(path, 'ab' if append else 'wb')
+        if self._file.tell() == 0:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['n_pixels'] = n_pixels
+            self._file.write(header.tobytes())
+        else:
+            assert read_header(path)['n_pixels'] == n_pixels, \
+                'Recording {} has a different number of pixels'.format(path)
+        dtype = record_dtype(n_pixels)
+        self._buffer = bytearray(dtype.itemsize)
+        self._record = np.frombuffer(self._buffer, dtype=dtype)[0]
+
+    def write(self, p, timestamp=None):
+        """Appends one frame of final pixel values
+
+        Parameters
+        ----------
+        p : np.array
+            (3, n) array of integer pixel values between 0 and 255.
+        timestamp : float, optional
+            Time of the frame in seconds. Defaults to the current time.
+        """
+        self._record['time'] = time.time() if timestamp is None else timestamp
+        pixels = self._record['pixels']
+        pixels[:, :p.shape[1]] = p
+        # The record is reused, clear what the previous frame left behind
+        pixels[:, p.shape[1]:] = 0
+        self._file.write(self._buffer)
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_header(path):
+    """Returns the header of a recording as a NumPy record"""
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC:
+        raise ValueError('{} is not an LED recording'.format(path))
+    if header[0]['version'] != VERSION:
+        raise ValueError('Unsupported recording version {}'.format(
+            header[0]['version']))
+    return header[0]
+
+
+def open_recording(path):
+    """Memory-maps the frames of a recording
+
+    Returns
+    -------
+    frames : np.memmap
+        Read-only array of records with 'time' and 'pixels' fields. A
+        partially written last frame is ignored.
+    """
+    n_pixels = int(read_header(path)['n_pixels'])
+    dtype = record_dtype(n_pixels)
+    n_frames = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // dtype.itemsize
+    if n_frames == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r',
+                     offset=HEADER_DTYPE.itemsize, shape=(n_frames,))
+
+
+class FramePlayer:
+    """Plays a recording back on the LED strip at its recorded timing
+
+    Frames are read straight from the memory-mapped file and passed to
+    output.led.write, so playback needs no audio processing at all.
+    """
+    def __init__(self, path):
+        self.frames = open_recording(path)
+
+    def play(self, speed=1.0, loop=False, write=None):
+        """Plays the recording, blocking until it has finished
+
+        Parameters
+        ----------
+        speed : float
+            Playback speed, 2.0 plays twice as fast.
+        loop : bool
+            Whether to start over at the end of the recording.
+        write : callable, optional
+            Receives the (3, n_pixels) pixel values of every frame.
+            Defaults to output.led.write.
+        """
+        if write is None:
+            from output import led
+            write = led.write
+        if len(self.frames) == 0:
+            return
+        times = self.frames['time']
+        pixels = self.frames['pixels']
+        while True:
+            start = time.time()
+            for k in range(len(self.frames)):
+                delay = start + (times[k] - times[0]) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                write(pixels[k])
+            if not loop:
+                break
@@ -0,0 +1,73 @@
+from __future__ import division, print_function
+
+from output.esp8266 import ESP8266Controller
+from settings import config
+
+
+class OutputRouter:
+    """Fans a rendered frame out to several ESP8266 controllers
+
+    Every controller drives its own range of the rendered pixels and keeps
+    its own socket and change-tracking state. All controllers are updated in
+    a single non-blocking pass, so a slow controller does not delay the
+    others or the audio thread.
+    """
+    def __init__(self, controllers):
+        self.controllers = list(controllers)
+
+    @classmethod
+    def from_config(cls):
+        """Creates the router described by config.CONTROLLERS
+
+        Without configured controllers the whole strip is sent to
+        config.UDP_IP and config.UDP_PORT. With config.ESP8266_ASYNC_OUTPUT
+        set, an AsyncOutputRouter is created instead.
+        """
+        if config.ESP8266_ASYNC_OUTPUT and cls is OutputRouter:
+            from output.transport import AsyncOutputRouter
+            return AsyncOutputRouter.from_config()
+        if config.CONTROLLERS is None:
+            return cls([ESP8266Controller(config.UDP_IP, config.UDP_PORT,
+                                          config.N_PIXELS,
+                                          protocol=config.ESP8266_PROTOCOL)])
+        controllers = []
+        first_pixel = 0
+        for ip, port, n_pixels in config.CONTROLLERS:
+            controllers.append(ESP8266Controller(
+                ip, port, n_pixels, first_pixel=first_pixel,
+                protocol=config.ESP8266_PROTOCOL))
+            first_pixel += n_pixels
+        assert first_pixel == config.N_PIXELS, \
+            'Controllers have {} pixels, expected {}'.format(first_pixel,
+                                                             config.N_PIXELS)
+        return cls(controllers)
+
+    @property
+    def n_pixels(self):
+        return max(c.last_pixel for c in self.controllers)
+
+    def send(self, frame):
+        """Sends a frame to every controller
+
+        Parameters
+        ----------
+        frame : np.array or sequence of np.array
+            Either one (3, n_pixels) array that is split according to each
+            controller's pixel range, or one array per controller (per-zone
+            frames), in the order of ``self.controllers``.
+        """
+        if isinstance(frame, (list, tuple)):
+            for controller, p in zip(self.controllers, frame):
+                self._send(controller, p)
+        else:
+            for controller in self.controllers:
+                p = frame[:, controller.first_pixel:controller.last_pixel]
+                self._send(controller, p)
+
+    def _send(self, controller, p):
+        controller.send(p)
+
+    def stats(self):
+        """Returns (address, packets sent, packets dropped) per controller"""
+        return [(c.address, c.packets_sent, c.packets_dropped)
+                for c in self.controllers]
@@ -0,0 +1,171 @@
+from __future__ import division, print_function
+
+import asyncio
+import atexit
+import threading
+
+import numpy as np
+
+from output.router import OutputRouter
+from visualizer import metrics
+
+
+class Destination(asyncio.DatagramProtocol):
+    """Pending frame, datagram transport and send statistics of a controller
+
+    Holds at most one frame. A frame that arrives before the pending one was
+    flushed replaces it, and the replaced frame is counted as dropped.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.transport = None
+        self.pending = None
+        """(submit time, frame) waiting for the next flush"""
+        self.paused = False
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.latency = 0.0
+        """Smoothed time from submitting a frame to sending it, in seconds"""
+        self.max_latency = 0.0
+        ip, port = controller.address
+        self._gauges = ('send_latency_ms {}:{}'.format(ip, port),
+                        'frames_dropped {}:{}'.format(ip, port))
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # The packet is unknown, so every pixel is sent again next frame
+        self.controller.packets_dropped += 1
+        self.controller.prev_pixels[:] = -1
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+
+    @property
+    def behind(self):
+        """Whether packets of a previous flush are still waiting to be sent"""
+        return self.paused or self.transport.get_write_buffer_size() > 0
+
+    def send(self, submitted, frame):
+        """Encodes a frame and hands its packets to the transport"""
+        for payload, idx in self.controller.encode(frame):
+            self.transport.sendto(payload, self.controller.address)
+            self.controller.packets_sent += 1
+        latency = metrics.clock() - submitted
+        self.latency += 0.1 * (latency - self.latency)
+        self.max_latency = max(self.max_latency, latency)
+        self.frames_sent += 1
+        metrics.stats.set(self._gauges[0], self.latency * 1e3)
+        metrics.stats.set(self._gauges[1], self.frames_dropped)
+
+
+class AsyncOutputRouter(OutputRouter):
+    """Sends frames to the ESP8266 controllers from an asyncio event loop
+
+    send() only stores the frame of every controller and wakes up the event
+    loop, which runs in its own thread. All pending frames are flushed in one
+    batch per loop iteration. A frame is encoded when it is flushed, so the
+    change tracking of a controller only ever sees frames that were actually
+    sent.
+
+    A controller falls behind when its socket buffer is full and the
+    transport still holds packets of an earlier frame. Its pending frame is
+    then kept until the transport has drained, and every newer frame
+    replaces it, so the controller always gets the newest frame and never a
+    backlog of stale ones.
+    """
+    def __init__(self, controllers):
+        super(AsyncOutputRouter, self).__init__(controllers)
+        self.destinations = [Destination(c) for c in self.controllers]
+        self._destination = dict(zip(self.controllers, self.destinations))
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+        self._loop = None
+        self._thread = None
+        self._closed = None
+
+    def start(self):
+        """Starts the event loop thread and opens the datagram transports"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,),
+                                        name='udp-output')
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+        atexit.register(self.close, 1.0)
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._closed = asyncio.Event()
+        for destination in self.destinations:
+            # Reuse the non-blocking socket of the controller
+            self._loop.run_until_complete(self._loop.create_datagram_endpoint(
+                lambda d=destination: d, sock=destination.controller.sock))
+        ready.set()
+        self._loop.run_until_complete(self._closed.wait())
+        for destination in self.destinations:
+            destination.transport.close()
+        # Let the transports finish closing
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+
+    def close(self, timeout=None):
+        """Sends the frames that can still be sent and stops the event loop
+
+        Called automatically when the interpreter exits, so the last frame,
+        usually the one switching the strip off, is not lost.
+        """
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._closed.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _send(self, controller, p):
+        destination = self._destination[controller]
+        frame = np.array(p)
+        with self._lock:
+            if destination.pending is not None:
+                destination.frames_dropped += 1
+            destination.pending = (metrics.clock(), frame)
+
+    def send(self, frame):
+        if self._thread is None:
+            self.start()
+        super(AsyncOutputRouter, self).send(frame)
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        batch = []
+        with self._lock:
+            for destination in self.destinations:
+                if destination.pending is not None and not destination.behind:
+                    batch.append((destination, destination.pending))
+                    destination.pending = None
+            held = any(d.pending is not None for d in self.destinations)
+            self._flush_scheduled = held
+        for destination, (submitted, frame) in batch:
+            destination.send(submitted, frame)
+        # Frames held back for a slow controller are retried shortly
+        if held:
+            self._loop.call_later(0.001, self._flush)
+
+    def stats(self):
+        """Returns (address, packets sent, packets dropped, frames sent,
+        frames dropped, send latency in ms, max send latency in ms) per
+        controller"""
+        return [(d.controller.address, d.controller.packets_sent,
+                 d.controller.packets_dropped, d.frames_sent,
+                 d.frames_dropped, d.latency * 1e3, d.max_latency * 1e3)
+                for d in self.destinations]
@@ -11,6 +11,7 @@ if DEVICE == DEVICES.ESP8266:
     UDP_IP = '192.168.0.150'            # IP address of the ESP8266. Must match IP in ws2812_controller.ino"""
     UDP_PORT = 7777                     # Port number used for socket communication between Python and ESP8266"""
     SOFTWARE_GAMMA_CORRECTION = False   # Set to False because the firmware handles gamma correction + dither"""
+    ESP8266_PROTOCOL = 'legacy'         # 'legacy' |i|r|g|b| packets (max 256 LEDs), or 'auto' to pick the smallest encoding (needs current firmware)"""
 elif DEVICE == DEVICES.PI:
     LED_PIN = 18                        # GPIO pin connected to the LED strip pixels (must support PWM)"""
     LED_FREQ_HZ = 800000                # LED signal frequency in Hz (usually 800kHz)"""
@@ -24,18 +25,72 @@ elif DEVICE == DEVICES.BLINKSTICK:
 USE_GUI = True
 """Whether or not to display a PyQtGraph GUI plot of visualization"""
 
+GUI_FPS = 30
+"""Maximum refresh rate of the GUI plots, independent of FPS"""
+
 DISPLAY_FPS = True
-"""Whether to display the FPS when running (can reduce performance)"""
+"""Whether to log the FPS and per-stage timings every METRICS_INTERVAL seconds"""
+
+METRICS_INTERVAL = 2.0
+"""Seconds between two log lines of FPS and per-stage timings"""
+
+METRICS_PORT = None
+"""Port serving FPS and per-stage timings as JSON on http://127.0.0.1:PORT/
+
+Use None to disable the endpoint.
+"""
 
 N_PIXELS = 99
 """Number of pixels in the LED strip (must match ESP8266 firmware)"""
 
+CONTROLLERS = None
+"""ESP8266 controllers sharing the strip, as (ip, port, n_pixels) tuples
+
+The rendered frame is split between the controllers in the listed order, so
+the pixel counts must add up to N_PIXELS. Use None to send the whole strip to
+UDP_IP and UDP_PORT.
+"""
+
+ESP8266_ASYNC_OUTPUT = False
+"""Whether to send the ESP8266 packets from an asyncio event loop thread
+
+The pipeline then only hands frames over, a slow controller or a congested
+Wi-Fi network cannot delay it. A controller that falls behind skips frames
+and always receives the newest one.
+"""
+
+ZONES = None
+"""Effects shown on consecutive parts of the strip, as (effect, n_pixels) tuples
+
+The mel spectrum is computed once per frame and rendered by every zone's
+effect into its own range of pixels, so the pixel counts must add up to
+N_PIXELS. Give the zones the pixel counts of CONTROLLERS to show a
+different effect on every ESP8266. Use None to show the selected
+visualization effect on the whole strip.
+"""
+
 GAMMA_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'gamma_table.npy')
 """Location of the gamma correction table"""
 
+MEL_CACHE_DIR = None
+"""Directory in which computed mel matrices are kept as .npy files
+
+Matrices are always cached in memory. With a directory, for example
+os.path.dirname(GAMMA_TABLE_PATH), they are also loaded from disk after a
+restart. Use None to keep them in memory only.
+"""
+
 MIC_RATE = 44100
 """Sampling frequency of the microphone in Hz"""
 
+CAPTURE_MODE = 'callback'
+"""How audio is read from the microphone
+
+'callback' lets PyAudio deliver each buffer as soon as the device fills it,
+which keeps capture latency at the device buffer size. 'blocking' reads the
+stream from the audio thread with stream.read.
+"""
+
 FPS = 60
 """Desired refresh rate of the visualization (frames per second)
 
@@ -55,6 +110,14 @@ depends on how long the LED strip is.
 _max_led_FPS = int(((N_PIXELS * 30e-6) + 50e-6)**-1.0)
 assert FPS <= _max_led_FPS, 'FPS must be <= {}'.format(_max_led_FPS)
 
+ADAPTIVE_QUALITY = True
+"""Whether to lower the visual quality in steps when frames take too long
+
+Under load the GUI plots, the audio history length, the blurs and finally
+every other frame are given up to keep up with the audio input. Quality is
+restored when there is headroom again.
+"""
+
 MIN_FREQUENCY = 200
 """Frequencies below this value will be removed during audio processing"""
 
@@ -79,5 +142,26 @@ There is no point using more bins than there are pixels on the LED strip.
 N_ROLLING_HISTORY = 2
 """Number of past audio frames to include in the rolling window"""
 
+FFT_WORKERS = None
+"""Number of threads scipy.fft may use per transform (None uses numpy.fft)"""
+
 MIN_VOLUME_THRESHOLD = 1e-7
 """No music visualization displayed if recorded audio volume below threshold"""
+
+PIPELINE_QUEUE_SIZE = 2
+"""Number of frames buffered between the capture, processing and output stages"""
+
+PIPELINE_DROP_POLICY = 'oldest'
+"""What to do when a pipeline stage falls behind
+
+'oldest' drops the oldest queued frame, 'newest' drops the incoming frame and
+'block' makes the previous stage wait (which can overflow the audio input).
+"""
+
+PIPELINE_BACKEND = 'threads'
+"""How the headless visualizer runs its capture, processing and output stages
+
+'threads' runs them as threads of one process. 'processes' runs every stage in
+its own process, so they do not compete for the GIL, and hands frames over
+through shared memory. The GUI always uses threads.
+"""
@@ -0,0 +1,51 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from audio import dsp, melbank
+
+
+def test_sparse_mel_bank_float64():
+    mel_y, _ = melbank.compute_melmat(num_mel_bands=24, freq_min=200,
+                                      freq_max=12000, num_fft_bands=1024,
+                                      sample_rate=44100)
+    bank = dsp.SparseMelBank(mel_y)
+    ys = np.abs(np.random.RandomState(0).randn(1024))
+    with np.errstate(all='raise'):
+        mel = bank(ys)
+    assert mel.dtype == np.float64
+    np.testing.assert_allclose(mel, np.dot(mel_y, ys))
+
+
+@pytest.mark.parametrize('num_bands, freq_min, freq_max, num_fft_bands', [
+    (12, 64, 8000, 513), (24, 200, 12000, 1024), (60, 20, 20000, 2049)])
+def test_sparse_mel_bank_matches_dense(num_bands, freq_min, freq_max,
+                                       num_fft_bands):
+    mel_y, _ = melbank.compute_melmat(num_bands, freq_min, freq_max,
+                                      num_fft_bands, sample_rate=44100)
+    bank = dsp.SparseMelBank(mel_y)
+    ys = np.abs(np.random.RandomState(1).randn(num_fft_bands))
+    np.testing.assert_allclose(bank(ys), mel_y @ ys)
+
+
+def test_filter_bank_matches_single_filters():
+    specs = [(np.tile(0.01, 8), 0.99, 0.01), (np.tile(0.01, 8), 0.1, 0.5)]
+    bank = dsp.ExpFilterBank(specs)
+    single = [dsp.ExpFilter(val, decay, rise) for val, decay, rise in specs]
+    rng = np.random.RandomState(2)
+    for _ in range(10):
+        y = rng.rand(8)
+        bank.update(y)
+        for f in single:
+            f.update(y)
+    for f, expected in zip(bank.filters, single):
+        np.testing.assert_array_equal(f.value, expected.value)
+
+
+def test_gaussian_filter1d_rows():
+    x = np.random.RandomState(0).rand(3, 40)
+    kernel = dsp.gaussian_kernel(4.0)
+    padded = x[:, dsp._reflect_indices(40, len(kernel) // 2)]
+    expected = [np.convolve(row, kernel, mode='valid') for row in padded]
+    np.testing.assert_allclose(dsp.gaussian_filter1d(x, 4.0), expected)
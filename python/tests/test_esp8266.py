@@ -0,0 +1,50 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from output.esp8266 import ESP8266Controller
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.packets = []
+
+    def sendto(self, payload, address):
+        self.packets.append(bytes(payload))
+
+
+def encode_reference(p, prev_pixels):
+    """The original encoder, which built every packet as a list of bytes"""
+    MAX_PIXELS_PER_PACKET = 126
+    idx = range(p.shape[1])
+    idx = [i for i in idx if not np.array_equal(p[:, i], prev_pixels[:, i])]
+    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
+    packets = []
+    for packet_indices in np.array_split(idx, n_packets):
+        m = []
+        for i in packet_indices:
+            m.append(i)
+            m.append(p[0][i])
+            m.append(p[1][i])
+            m.append(p[2][i])
+        packets.append(bytes(m))
+    return packets
+
+
+@pytest.mark.parametrize('n_pixels, width',
+                         [(99, 99), (99, 98), (256, 256), (256, 254)])
+def test_legacy_packets_match_reference(n_pixels, width):
+    rng = np.random.RandomState(0)
+    sock = RecordingSocket()
+    controller = ESP8266Controller('127.0.0.1', 7777, n_pixels, sock=sock)
+    prev_pixels = np.tile(253, (3, n_pixels))
+    for changed in [1.0, 0.0, 0.1, 0.5, 0.9, 1.0]:
+        p = np.copy(prev_pixels[:, :width])
+        mask = rng.rand(width) < changed
+        p[:, mask] = rng.randint(0, 253, (3, mask.sum()))
+        expected = encode_reference(p, prev_pixels)
+        prev_pixels = np.copy(p)
+        del sock.packets[:]
+        controller.send(p)
+        assert sock.packets == expected
@@ -0,0 +1,43 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from audio import melbank
+
+
+def compute_melmat_loop(num_mel_bands, freq_min, freq_max, num_fft_bands,
+                        sample_rate):
+    """Band by band reference implementation of compute_melmat"""
+    center_frequencies_mel, lower_edges_mel, upper_edges_mel = \
+        melbank.melfrequencies_mel_filterbank(
+            num_mel_bands, freq_min, freq_max, num_fft_bands)
+    center_frequencies_hz = melbank.mel_to_hertz(center_frequencies_mel)
+    lower_edges_hz = melbank.mel_to_hertz(lower_edges_mel)
+    upper_edges_hz = melbank.mel_to_hertz(upper_edges_mel)
+    freqs = np.linspace(0.0, sample_rate / 2.0, num_fft_bands)
+    melmat = np.zeros((num_mel_bands, num_fft_bands))
+    for imelband, (center, lower, upper) in enumerate(zip(
+            center_frequencies_hz, lower_edges_hz, upper_edges_hz)):
+        left_slope = (freqs >= lower) == (freqs <= center)
+        melmat[imelband, left_slope] = (
+            (freqs[left_slope] - lower) / (center - lower))
+        right_slope = (freqs >= center) == (freqs <= upper)
+        melmat[imelband, right_slope] = (
+            (upper - freqs[right_slope]) / (upper - center))
+    return melmat, (center_frequencies_mel, freqs)
+
+
+@pytest.mark.parametrize('num_mel_bands', [1, 12, 24, 64])
+@pytest.mark.parametrize('freq_min, freq_max',
+                         [(64, 8000), (200, 12000), (20, 22050)])
+@pytest.mark.parametrize('num_fft_bands', [257, 735, 1470])
+@pytest.mark.parametrize('sample_rate', [16000, 44100, 48000])
+def test_compute_melmat_matches_loop(num_mel_bands, freq_min, freq_max,
+                                     num_fft_bands, sample_rate):
+    args = (num_mel_bands, freq_min, freq_max, num_fft_bands, sample_rate)
+    expected, (expected_mel, expected_freqs) = compute_melmat_loop(*args)
+    melmat, (mel, freqs) = melbank.compute_melmat(*args)
+    np.testing.assert_array_equal(mel, expected_mel)
+    np.testing.assert_array_equal(freqs, expected_freqs)
+    np.testing.assert_array_equal(melmat, expected)
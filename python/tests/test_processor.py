@@ -0,0 +1,36 @@
+from __future__ import division
+
+import numpy as np
+
+from audio import dsp
+from output import led
+from settings import config
+from visualizer import effects
+from visualizer.processor import Processor
+
+
+class Parent:
+    def __init__(self):
+        self.visualization_effect = effects.create('spectrum')
+
+
+def test_reconfigure_with_frames_in_flight(monkeypatch):
+    monkeypatch.setattr(config, 'USE_GUI', True)
+    monkeypatch.setattr(config, 'ADAPTIVE_QUALITY', False)
+    monkeypatch.setattr(led, 'write', lambda p: None)
+    n_bins = config.N_FFT_BINS
+    processor = Processor(Parent())
+    t = np.arange(processor.samples_per_frame) / config.MIC_RATE
+    samples = 0.5 * np.sin(2 * np.pi * 440.0 * t)
+    try:
+        # The processing thread moves on to the new mel bank while the
+        # output thread still has a frame of the old one queued
+        queued = [(processor.process(samples), processor.mel)]
+        dsp.reconfigure(N_FFT_BINS=n_bins - 8)
+        queued.append((processor.process(samples), processor.mel))
+        for output, mel in queued:
+            processor.show(output, mel)
+    finally:
+        dsp.reconfigure(N_FFT_BINS=n_bins)
+    mel, _ = processor.plots.read()
+    assert len(mel) == n_bins - 8
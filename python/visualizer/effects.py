@@ -1,26 +1,32 @@
 from __future__ import division, print_function
 
-import time
-
 import numpy as np
-from scipy.ndimage.filters import gaussian_filter1d
 
 from audio import dsp
 from settings import config
 
-r_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.2, alpha_rise=0.99)
-g_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.05, alpha_rise=0.3)
-b_filt = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                       alpha_decay=0.1, alpha_rise=0.5)
-common_mode = dsp.ExpFilter(np.tile(0.01, config.N_PIXELS // 2),
-                            alpha_decay=0.99, alpha_rise=0.01)
-p_filt = dsp.ExpFilter(np.tile(1, (3, config.N_PIXELS // 2)),
-                       alpha_decay=0.1, alpha_rise=0.99)
-p = np.tile(1.0, (3, config.N_PIXELS // 2))
-gain = dsp.ExpFilter(np.tile(0.01, config.N_FFT_BINS),
-                     alpha_decay=0.001, alpha_rise=0.99)
+EFFECTS = {}
+"""Visualization effect classes by name, as selected with --mode"""
+
+
+def register(name):
+    """Class decorator that adds an effect to EFFECTS as ``name``"""
+    def decorator(cls):
+        cls.name = name
+        EFFECTS[name] = cls
+        return cls
+    return decorator
+
+
+def create(name, n_pixels=None, n_bins=None):
+    """Creates the effect registered as ``name``
+
+    Raises ValueError if there is no such effect.
+    """
+    if name not in EFFECTS:
+        raise ValueError('Unknown visualizer mode {}, expected one of {}'
+                         .format(name, ', '.join(sorted(EFFECTS))))
+    return EFFECTS[name](n_pixels, n_bins)
 
 
 def memoize(function):
@@ -69,75 +75,173 @@ def interpolate(y, new_length):
     return z
 
 
-def scroll(y):
+class Effect:
+    """Base class of the visualization effects
+
+    An effect turns normalized mel spectra into pixel values for one LED
+    strip. All state and buffers belong to the instance and are allocated
+    when it is constructed, for a strip of ``n_pixels`` pixels and mel
+    spectra of ``n_bins`` bands (defaulting to the config module), so any
+    number of effects of any size can run side by side.
+    """
+    name = None
+    """Name of the effect in EFFECTS, set by register()"""
+    blur = True
+    """Whether to smooth the pixels, turned off by the Processor under load"""
+
+    def __init__(self, n_pixels=None, n_bins=None):
+        self.n_pixels = config.N_PIXELS if n_pixels is None else n_pixels
+        self.n_bins = config.N_FFT_BINS if n_bins is None else n_bins
+
+    def render(self, mel, out):
+        """Writes the pixel values for one frame into ``out``
+
+        Parameters
+        ----------
+        mel : np.array
+            Normalized mel spectrum with n_bins values.
+        out : np.array
+            (3, n_pixels) float array that receives the pixel values.
+
+        Returns
+        -------
+        out : np.array
+            The ``out`` array.
+        """
+        raise NotImplementedError
+
+    def resize(self, n_bins):
+        """Starts over with the state for mel spectra of ``n_bins`` bands"""
+        self.__init__(self.n_pixels, n_bins)
+
+    def __call__(self, mel):
+        """Renders one frame into a new (3, n_pixels) array"""
+        return self.render(mel, np.empty((3, self.n_pixels)))
+
+    def _mirror(self, channels, out):
+        """Writes the three channels mirrored around the center of the strip
+
+        With an odd number of pixels the last pixel stays black.
+        """
+        half = self.n_pixels // 2
+        for k, channel in enumerate(channels):
+            out[k, :half] = channel[::-1]
+            out[k, half:2 * half] = channel
+        out[:, 2 * half:] = 0.0
+        return out
+
+
+@register('scroll')
+class Scroll(Effect):
     """Effect that originates in the center and scrolls outwards"""
-    global p
-    y = y**2.0
-    gain.update(y)
-    y /= gain.value
-    y *= 255.0
-    r = int(np.max(y[:len(y) // 3]))
-    g = int(np.max(y[len(y) // 3: 2 * len(y) // 3]))
-    b = int(np.max(y[2 * len(y) // 3:]))
-    # Scrolling effect window
-    p[:, 1:] = p[:, :-1]
-    p *= 0.98
-    p = gaussian_filter1d(p, sigma=0.2)
-    # Create new color originating at the center
-    p[0, 0] = r
-    p[1, 0] = g
-    p[2, 0] = b
-    # Update the LED strip
-    return np.concatenate((p[:, ::-1], p), axis=1)
-
-
-def energy(y):
+    def __init__(self, n_pixels=None, n_bins=None):
+        super(Scroll, self).__init__(n_pixels, n_bins)
+        self.gain = dsp.ExpFilter(np.tile(0.01, self.n_bins),
+                                  alpha_decay=0.001, alpha_rise=0.99)
+        self.p = np.tile(1.0, (3, self.n_pixels // 2))
+        self._blurred = np.empty_like(self.p)
+        self._y = np.empty(self.n_bins)
+
+    def render(self, mel, out):
+        y = np.power(mel, 2.0, out=self._y)
+        self.gain.update(y)
+        y /= self.gain.value
+        y *= 255.0
+        r = int(np.max(y[:len(y) // 3]))
+        g = int(np.max(y[len(y) // 3: 2 * len(y) // 3]))
+        b = int(np.max(y[2 * len(y) // 3:]))
+        # Scrolling effect window
+        p = self.p
+        p[:, 1:] = p[:, :-1]
+        p *= 0.98
+        if self.blur:
+            p = dsp.gaussian_filter1d(p, sigma=0.2, out=self._blurred)
+            self.p, self._blurred = p, self.p
+        # Create new color originating at the center
+        p[0, 0] = r
+        p[1, 0] = g
+        p[2, 0] = b
+        # Update the LED strip
+        return self._mirror(p, out)
+
+
+@register('energy')
+class Energy(Effect):
     """Effect that expands from the center with increasing sound energy"""
-    global p
-    y = np.copy(y)
-    gain.update(y)
-    y /= gain.value
-    # Scale by the width of the LED strip
-    y *= float((config.N_PIXELS // 2) - 1)
-    # Map color channels according to energy in the different freq bands
-    scale = 0.9
-    r = int(np.mean(y[:len(y) // 3]**scale))
-    g = int(np.mean(y[len(y) // 3: 2 * len(y) // 3]**scale))
-    b = int(np.mean(y[2 * len(y) // 3:]**scale))
-    # Assign color to different frequency regions
-    p[0, :r] = 255.0
-    p[0, r:] = 0.0
-    p[1, :g] = 255.0
-    p[1, g:] = 0.0
-    p[2, :b] = 255.0
-    p[2, b:] = 0.0
-    p_filt.update(p)
-    p = np.round(p_filt.value)
-    # Apply substantial blur to smooth the edges
-    p[0, :] = gaussian_filter1d(p[0, :], sigma=4.0)
-    p[1, :] = gaussian_filter1d(p[1, :], sigma=4.0)
-    p[2, :] = gaussian_filter1d(p[2, :], sigma=4.0)
-    # Set the new pixel value
-    return np.concatenate((p[:, ::-1], p), axis=1)
-
-
-_prev_spectrum = np.tile(0.01, config.N_PIXELS // 2)
-
-
-def spectrum(y):
+    def __init__(self, n_pixels=None, n_bins=None):
+        super(Energy, self).__init__(n_pixels, n_bins)
+        self.gain = dsp.ExpFilter(np.tile(0.01, self.n_bins),
+                                  alpha_decay=0.001, alpha_rise=0.99)
+        self.p_filt = dsp.ExpFilter(np.tile(1, (3, self.n_pixels // 2)),
+                                    alpha_decay=0.1, alpha_rise=0.99)
+        self.p = np.tile(1.0, (3, self.n_pixels // 2))
+        self._rounded = np.empty_like(self.p)
+        self._y = np.empty(self.n_bins)
+
+    def render(self, mel, out):
+        y = self._y
+        y[:] = mel
+        self.gain.update(y)
+        y /= self.gain.value
+        # Scale by the width of the LED strip
+        y *= float((self.n_pixels // 2) - 1)
+        # Map color channels according to energy in the different freq bands
+        scale = 0.9
+        r = int(np.mean(y[:len(y) // 3]**scale))
+        g = int(np.mean(y[len(y) // 3: 2 * len(y) // 3]**scale))
+        b = int(np.mean(y[2 * len(y) // 3:]**scale))
+        # Assign color to different frequency regions
+        p = self.p
+        p[0, :r] = 255.0
+        p[0, r:] = 0.0
+        p[1, :g] = 255.0
+        p[1, g:] = 0.0
+        p[2, :b] = 255.0
+        p[2, b:] = 0.0
+        self.p_filt.update(p)
+        if self.blur:
+            np.round(self.p_filt.value, out=self._rounded)
+            # Apply substantial blur to smooth the edges
+            dsp.gaussian_filter1d(self._rounded, sigma=4.0, out=p)
+        else:
+            np.round(self.p_filt.value, out=p)
+        # Set the new pixel value
+        return self._mirror(p, out)
+
+
+@register('spectrum')
+class Spectrum(Effect):
     """Effect that maps the Mel filterbank frequencies onto the LED strip"""
-    global _prev_spectrum
-    y = np.copy(interpolate(y, config.N_PIXELS // 2))
-    common_mode.update(y)
-    diff = y - _prev_spectrum
-    _prev_spectrum = np.copy(y)
-    # Color channel mappings
-    r = r_filt.update(y - common_mode.value)
-    g = np.abs(diff)
-    b = b_filt.update(np.copy(y))
-    # Mirror the color channels for symmetric output
-    r = np.concatenate((r[::-1], r))
-    g = np.concatenate((g[::-1], g))
-    b = np.concatenate((b[::-1], b))
-    output = np.array([r, g, b]) * 255
-    return output
+    def __init__(self, n_pixels=None, n_bins=None):
+        super(Spectrum, self).__init__(n_pixels, n_bins)
+        half = self.n_pixels // 2
+        self.r_filt = dsp.ExpFilter(np.tile(0.01, half),
+                                    alpha_decay=0.2, alpha_rise=0.99)
+        self.g_filt = dsp.ExpFilter(np.tile(0.01, half),
+                                    alpha_decay=0.05, alpha_rise=0.3)
+        # Both filters smooth the spectrum, they are updated in one call
+        self._filters = dsp.ExpFilterBank([
+            (np.tile(0.01, half), 0.99, 0.01),
+            (np.tile(0.01, half), 0.1, 0.5),
+        ])
+        self.common_mode, self.b_filt = self._filters.filters
+        self._prev_spectrum = np.tile(0.01, half)
+        self._y = np.empty(half)
+        self._diff = np.empty(half)
+        self._r = np.empty(half)
+
+    def render(self, mel, out):
+        y = self._y
+        y[:] = interpolate(mel, len(y))
+        self._filters.update(y)
+        diff = np.subtract(y, self._prev_spectrum, out=self._diff)
+        self._prev_spectrum[:] = y
+        # Color channel mappings
+        r = self.r_filt.update(
+            np.subtract(y, self.common_mode.value, out=self._r))
+        g = np.abs(diff, out=diff)
+        b = self.b_filt.value
+        # Mirror the color channels for symmetric output
+        self._mirror((r, g, b), out)
+        out *= 255
+        return out
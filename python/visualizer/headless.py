@@ -0,0 +1,67 @@
+from __future__ import division, print_function
+
+import signal
+import threading
+
+import numpy as np
+
+from output import led
+from settings import config
+from visualizer import effects
+from visualizer.pipeline import AudioPipeline
+from visualizer.processor import Processor
+
+
+class HeadlessRunner:
+    """Runs the visualizer as a long-lived service without a GUI
+
+    Owns the audio pipeline and the Processor, and takes the place of the
+    GUI as the Processor's parent. SIGINT and SIGTERM stop the pipeline and
+    switch the LED strip off.
+
+    With config.PIPELINE_BACKEND set to 'processes' the stages run in a
+    ProcessPipeline instead, whose output process owns the LED strip.
+
+    Every frame sent to the strip is appended to the recording at ``record``
+    when it is given.
+    """
+    def __init__(self, mode='spectrum', device=None, record=None):
+        self.visualization_effect = effects.create(mode)
+        config.USE_GUI = False
+        self.owns_strip = config.PIPELINE_BACKEND != 'processes'
+        self.recorder = None
+        if self.owns_strip:
+            self.pipeline = AudioPipeline(Processor(self), device=device)
+            # Open the output device now rather than on the first frame
+            led.setup()
+            if record is not None:
+                from output.recording import FrameRecorder
+                self.recorder = FrameRecorder(record, config.N_PIXELS)
+                led.recorder = self.recorder
+        else:
+            # Imports multiprocessing, only needed with this backend
+            from visualizer.processes import ProcessPipeline
+            self.pipeline = ProcessPipeline(mode, device=device, record=record)
+        self._stop_event = threading.Event()
+
+    def stop(self, *args):
+        """Requests the runner to stop, usable as a signal handler"""
+        self._stop_event.set()
+
+    def run(self):
+        """Runs until stop() is called or SIGINT/SIGTERM is received"""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        self.pipeline.start()
+        print('Visualizer running headless, press Ctrl+C to stop')
+        # Wait with a timeout so the main thread keeps handling signals
+        while not self._stop_event.wait(0.5):
+            if not self.pipeline.is_alive():
+                break
+        self.pipeline.stop(timeout=2.0)
+        if self.owns_strip:
+            # Turn all pixels off
+            led.pixels = np.tile(0, (3, config.N_PIXELS))
+            led.update()
+        if self.recorder is not None:
+            self.recorder.close()
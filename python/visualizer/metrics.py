@@ -0,0 +1,152 @@
+from __future__ import division, print_function
+
+import json
+import threading
+import time
+
+import numpy as np
+
+from settings import config
+
+clock = time.perf_counter
+"""Clock used by all timing probes"""
+
+
+class StageTimer:
+    """Rolling window of the most recent durations of one pipeline stage
+
+    Durations are written into a preallocated ring, so recording a sample
+    never allocates. Percentiles are only computed when a summary is asked
+    for.
+    """
+    def __init__(self, size=512):
+        self.durations = np.zeros(size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.durations[self.count % len(self.durations)] = seconds
+        self.count += 1
+
+    def summary(self):
+        """Returns p50, p99 and max of the window in microseconds"""
+        n = min(self.count, len(self.durations))
+        if n == 0:
+            return {'p50': 0.0, 'p99': 0.0, 'max': 0.0, 'count': 0}
+        p50, p99 = np.percentile(self.durations[:n], [50, 99]) * 1e6
+        return {'p50': float(p50), 'p99': float(p99),
+                'max': float(self.durations[:n].max() * 1e6),
+                'count': self.count}
+
+
+class Metrics:
+    """Timing probes for the hot path of the visualizer
+
+    Probes are meant to stay enabled in production, a probe costs well under
+    a microsecond:
+
+        t = metrics.clock()
+        ...  # stage one
+        t = stats.lap('one', t)
+        ...  # stage two
+        stats.lap('two', t)
+
+    The time between frames is recorded as the 'frame' stage, from which the
+    frame rate is derived.
+    """
+    def __init__(self, window=512):
+        self.window = window
+        self.stages = {}
+        self.gauges = {}
+        """Latest values of state metrics, such as the quality level"""
+        self._prev_frame = None
+        self._prev_report = clock()
+        self._server = None
+
+    def lap(self, stage, start):
+        """Records the time since ``start`` for ``stage`` and returns now"""
+        now = clock()
+        timer = self.stages.get(stage)
+        if timer is None:
+            timer = self.stages[stage] = StageTimer(self.window)
+        timer.add(now - start)
+        return now
+
+    def set(self, name, value):
+        """Records the current value of a state metric"""
+        self.gauges[name] = value
+
+    def frame(self):
+        """Marks the end of a frame"""
+        now = clock()
+        if self._prev_frame is not None:
+            self.lap('frame', self._prev_frame)
+        self._prev_frame = now
+
+    def fps(self):
+        """Returns the median frame rate over the rolling window"""
+        timer = self.stages.get('frame')
+        if timer is None or timer.count == 0:
+            return 0.0
+        p50 = timer.summary()['p50']
+        return 1e6 / p50 if p50 > 0 else 0.0
+
+    def summary(self):
+        """Returns the frame rate, the gauges and the summary of every stage"""
+        # Pipeline threads may add stages and gauges meanwhile, the lists are
+        # taken in one step
+        return {'fps': self.fps(),
+                'gauges': dict(list(self.gauges.items())),
+                'stages': dict((name, timer.summary())
+                               for name, timer in list(self.stages.items()))}
+
+    def log_line(self):
+        """Formats the frame rate and the p50/p99/max of every stage"""
+        parts = ['FPS {:.0f} / {:.0f}'.format(self.fps(), config.FPS)]
+        for name, value in sorted(list(self.gauges.items())):
+            parts.append('{} {}'.format(name, value))
+        for name, timer in sorted(list(self.stages.items())):
+            if name == 'frame':
+                continue
+            s = timer.summary()
+            parts.append('{} {:.0f}/{:.0f}/{:.0f}us'.format(
+                name, s['p50'], s['p99'], s['max']))
+        return ' | '.join(parts)
+
+    def report(self):
+        """Prints the log line once every config.METRICS_INTERVAL seconds"""
+        now = clock()
+        if now - self._prev_report >= config.METRICS_INTERVAL:
+            self._prev_report = now
+            print(self.log_line())
+
+    def serve(self, port):
+        """Serves the summary as JSON on http://127.0.0.1:port/
+
+        The server runs in a daemon thread and is only started once.
+        """
+        if self._server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.summary()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='metrics')
+        thread.daemon = True
+        thread.start()
+
+
+stats = Metrics()
+"""Metrics shared by all stages of the visualizer"""
@@ -0,0 +1,118 @@
+from __future__ import division, print_function
+
+import time
+import wave
+
+import numpy as np
+
+from audio import dsp
+from output import led
+from output.recording import FrameRecorder
+from settings import config
+from visualizer import effects
+from visualizer.processor import Processor
+
+BATCH_FRAMES = 256
+"""Number of frames whose spectra are computed in one batch"""
+
+
+def read_wav(path):
+    """Reads a 16-bit PCM WAV file
+
+    Returns
+    -------
+    samples : np.array
+        Mono samples normalized to values between -1 and 1. Multi-channel
+        files are mixed down by averaging the channels.
+    rate : int
+        Sampling frequency in Hz.
+    """
+    f = wave.open(path, 'rb')
+    try:
+        if f.getsampwidth() != 2:
+            raise ValueError('Only 16-bit PCM WAV files are supported')
+        channels = f.getnchannels()
+        rate = f.getframerate()
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+    finally:
+        f.close()
+    samples = data.reshape(-1, channels).mean(axis=1) / 2.0**15
+    return samples.astype(np.float32), rate
+
+
+def rolling_windows(samples, samples_per_frame, n_frames):
+    """Returns the rolling window of audio for every frame as one array
+
+    The windows are the same ones the Processor builds from a live stream:
+    window k holds the n_frames frames up to and including frame k, and the
+    first windows are padded with silence. The result is a read-only view
+    of (n_windows, n_frames * samples_per_frame) samples.
+    """
+    padded = np.concatenate((
+        np.zeros((n_frames - 1) * samples_per_frame, dtype=samples.dtype),
+        samples[:len(samples) // samples_per_frame * samples_per_frame]))
+    view = np.lib.stride_tricks.sliding_window_view(
+        padded, n_frames * samples_per_frame)
+    return view[::samples_per_frame]
+
+
+class OfflineRenderer:
+    """Renders an audio file to LED frames faster than real time
+
+    The spectra of all frames are computed in batches of 2-D NumPy
+    operations. Only the gain normalization and the effect, which depend on
+    the previous frames, run frame by frame.
+    """
+    def __init__(self, mode='spectrum'):
+        self.visualization_effect = effects.create(mode)
+
+    def frames(self, samples):
+        """Yields the (3, n) pixel values of every frame of ``samples``"""
+        processor = Processor(self)
+        analyzer = processor.analyzer
+        windows = rolling_windows(samples, processor.samples_per_frame,
+                                  config.N_ROLLING_HISTORY)
+        silence = np.tile(0, (3, config.N_PIXELS))
+        for start in range(0, len(windows), BATCH_FRAMES):
+            batch = windows[start:start + BATCH_FRAMES]
+            volume = np.abs(batch).max(axis=1)
+            mel = np.dot(analyzer.batch(batch), processor.state.mel_y.T)
+            for k in range(len(batch)):
+                if volume[k] < config.MIN_VOLUME_THRESHOLD:
+                    yield silence
+                else:
+                    yield processor.render(mel[k])
+
+    def render(self, samples, path):
+        """Renders ``samples`` to an LED recording
+
+        The recording holds the final, gamma corrected frames config.FPS
+        apart and can be played back with output.recording.FramePlayer.
+
+        Returns the number of frames written.
+        """
+        recorder = FrameRecorder(path, config.N_PIXELS, append=False)
+        frame_time = 1.0 / config.FPS
+        try:
+            for k, output in enumerate(self.frames(samples)):
+                p = led.gamma_correct(np.clip(output, 0, 255).astype(int))
+                recorder.write(p, timestamp=k * frame_time)
+        finally:
+            recorder.close()
+        return recorder.frames
+
+
+def render_file(wav_path, output_path, mode='spectrum'):
+    """Renders a WAV file to LED frames and prints the rendering speed"""
+    samples, rate = read_wav(wav_path)
+    # Render at the file's sampling frequency
+    dsp.reconfigure(MIC_RATE=rate)
+    renderer = OfflineRenderer(mode)
+    start = time.time()
+    n_frames = renderer.render(samples, output_path)
+    elapsed = time.time() - start
+    duration = len(samples) / rate
+    print('Rendered {} frames ({:.1f} s of audio) in {:.1f} s, {:.0f}x real '
+          'time'.format(n_frames, duration, elapsed,
+                        duration / max(elapsed, 1e-9)))
+    return n_frames
@@ -0,0 +1,214 @@
+from __future__ import division, print_function
+
+import threading
+import time
+from collections import deque
+
+from audio.microphone import AudioInputProcess
+from settings import config
+
+
+class FrameQueue:
+    """Bounded, thread-safe queue of frames between two pipeline stages
+
+    When the queue is full, ``policy`` decides what happens to a new frame:
+        'oldest': the oldest queued frame is dropped to make room
+        'newest': the new frame is dropped
+        'block':  the producer waits until there is room
+
+    ``discard`` is called with every frame that is dropped or cleared.
+    """
+    def __init__(self, maxsize, policy='oldest', discard=None):
+        assert maxsize > 0, 'Queue size must be positive'
+        assert policy in ('oldest', 'newest', 'block'), \
+            'Unknown drop policy {}'.format(policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        """Number of frames discarded because the queue was full"""
+        self.discard = discard if discard is not None else lambda item: None
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, timeout=None):
+        """Adds a frame, returns False if a frame had to be dropped"""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'block':
+                    self._cond.wait_for(
+                        lambda: len(self._items) < self.maxsize, timeout)
+                if len(self._items) >= self.maxsize:
+                    self.dropped += 1
+                    if self.policy == 'newest':
+                        self.discard(item)
+                        return False
+                    self.discard(self._items.popleft())
+                    self._items.append(item)
+                    self._cond.notify_all()
+                    return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Removes and returns the oldest frame, or None after ``timeout``"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def clear(self):
+        with self._cond:
+            for item in self._items:
+                self.discard(item)
+            self._items.clear()
+            self._cond.notify_all()
+
+
+class AudioPipeline:
+    """Runs capture, processing and output in separate threads
+
+    The capture stage only converts audio into the preallocated ring of the
+    AudioInputProcess and queues the ring slots. The processing stage turns
+    audio into pixels with ``processor.process``, then hands the slot back
+    to the ring, and the output stage sends the pixels with
+    ``processor.show``. The stages are connected by bounded FrameQueues, so
+    a slow GUI redraw or a stalled Wi-Fi send drops frames instead of
+    overflowing the audio input buffer.
+
+    ``source`` is the capture thread class. It is constructed like an
+    AudioInputProcess and must provide its stop() and release() methods and
+    its ``dropped`` counter.
+
+    A frame is counted as late when it is shown more than one frame period
+    after it was captured.
+    """
+    def __init__(self, processor, device=None, update=None,
+                 queue_size=None, policy=None, source=AudioInputProcess):
+        self.processor = processor
+        self.device = device
+        self.source = source
+        self.update = update if update is not None else lambda: None
+        queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+        policy = policy or config.PIPELINE_DROP_POLICY
+        self.audio_queue = FrameQueue(queue_size, policy,
+                                      discard=self._release)
+        self.pixel_queue = FrameQueue(queue_size, policy)
+        self.frames_captured = 0
+        self.frames_shown = 0
+        self.frames_late = 0
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Starts all stages, restarting them if they were stopped"""
+        if self.is_alive():
+            return
+        self._stop_event.clear()
+        self.audio_queue.clear()
+        self.pixel_queue.clear()
+        self._threads = [
+            self._create_source(),
+            threading.Thread(target=self._process_loop, name='processing'),
+            threading.Thread(target=self._output_loop, name='output'),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _create_source(self):
+        # Queued frames and the frame being processed hold their ring slots,
+        # the capture thread drops a frame when no slot is left
+        ring_size = self.audio_queue.maxsize + 2
+        return self.source(args=(self._capture, self.device, lambda: None),
+                           kwargs={'ring_size': ring_size, 'hold': True})
+
+    def set_device(self, device, timeout=None):
+        """Switches the capture stage to another audio input device
+
+        Only the capture thread is restarted. The processing and output
+        stages keep running, and the Processor keeps its state.
+        """
+        self.device = device
+        if not self.is_alive():
+            return
+        source = self._threads[0]
+        source.stop()
+        # Wakes up a capture thread blocked on a full queue
+        self.audio_queue.clear()
+        source.join(timeout)
+        source = self._threads[0] = self._create_source()
+        source.daemon = True
+        source.start()
+
+    def stop(self, timeout=None):
+        """Stops all stages and waits up to ``timeout`` seconds for each"""
+        self._stop_event.set()
+        if self._threads:
+            # The capture thread comes first
+            self._threads[0].stop()
+            # Wakes up a capture thread blocked on a full queue
+            self.audio_queue.clear()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        """Returns the frame counters of all stages"""
+        return {
+            'captured': self.frames_captured,
+            'shown': self.frames_shown,
+            'late': self.frames_late,
+            'dropped_audio': self.audio_queue.dropped +
+                             (self._threads[0].dropped if self._threads else 0),
+            'dropped_pixels': self.pixel_queue.dropped,
+        }
+
+    def _release(self, item):
+        self._threads[0].release(item[1])
+
+    def _capture(self, audio_samples):
+        self.frames_captured += 1
+        self.audio_queue.put((time.time(), audio_samples))
+
+    def _process_loop(self):
+        while not self._stop_event.is_set():
+            item = self.audio_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            timestamp, audio_samples = item
+            output = self.processor.process(audio_samples)
+            self._threads[0].release(audio_samples)
+            # The mel spectrum of the frame goes along for the GUI plots
+            self.pixel_queue.put((timestamp, output, self.processor.mel))
+
+    def _output_loop(self):
+        prev_report = time.time()
+        reported = None
+        while not self._stop_event.is_set():
+            item = self.pixel_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            timestamp, output, mel = item
+            self.processor.show(output, mel)
+            self.update()
+            self.frames_shown += 1
+            if time.time() - timestamp > 1.0 / config.FPS:
+                self.frames_late += 1
+            if time.time() > prev_report + 1:
+                prev_report = time.time()
+                stats = self.stats()
+                dropped = (stats['dropped_audio'], stats['dropped_pixels'],
+                           stats['late'])
+                if dropped != reported and any(dropped):
+                    reported = dropped
+                    print('Pipeline dropped {} audio and {} pixel frames, '
+                          '{} frames late'.format(*dropped))
@@ -0,0 +1,61 @@
+from __future__ import division, print_function
+
+import numpy as np
+
+
+def _copy_into(buffer, values):
+    """Copies ``values`` into ``buffer``, reallocating it if the shape differs"""
+    if buffer is None or buffer.shape != np.shape(values):
+        return np.array(values, dtype=float)
+    np.copyto(buffer, values)
+    return buffer
+
+
+class PlotBuffer:
+    """Lock-free double buffer passing the newest frame to the GUI thread
+
+    The output thread copies every frame into the back slot of two
+    preallocated slots and then publishes it by flipping ``_front``. Both
+    are single reference assignments, so neither the output thread nor the
+    GUI thread ever waits for the other. Each slot has a sequence number
+    that is odd while the slot is written, which lets the reader detect a
+    slot that was overwritten while it was being copied. Such a frame is
+    skipped and the next read returns a newer one.
+    """
+    def __init__(self):
+        self._slots = [[None, None], [None, None]]
+        self._seq = [0, 0]
+        self._front = 0
+        self.version = 0
+        """Number of frames written"""
+        self._read_version = 0
+
+    def write(self, mel, pixels):
+        """Publishes the mel spectrum and the pixel values of a frame"""
+        back = 1 - self._front
+        slot = self._slots[back]
+        self._seq[back] += 1
+        slot[0] = _copy_into(slot[0], mel)
+        slot[1] = _copy_into(slot[1], pixels)
+        self._seq[back] += 1
+        self._front = back
+        self.version += 1
+
+    def read(self):
+        """Returns copies of the newest (mel, pixels) frame
+
+        Returns None if no frame was written since the last read, or if the
+        newest frame was overwritten while it was being copied.
+        """
+        version = self.version
+        if version == self._read_version:
+            return None
+        front = self._front
+        seq = self._seq[front]
+        if seq % 2 == 1:
+            return None
+        mel, pixels = [np.copy(values) for values in self._slots[front]]
+        if self._seq[front] != seq:
+            return None
+        self._read_version = version
+        return mel, pixels
@@ -0,0 +1,260 @@
+from __future__ import division, print_function
+
+import multiprocessing
+import signal
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from settings import config
+
+_WRITTEN, _READ, _DROPPED = range(3)
+_HEADER = 3
+"""Counters at the start of every ring: frames written, read and dropped"""
+
+
+class SharedRing:
+    """Ring buffer of fixed-size frames in shared memory
+
+    One process writes frames and one process reads them. Frames are copied
+    in and out of the shared block directly, so nothing is pickled. The
+    block starts with the written, read and dropped counters, followed by
+    the sequence number of the frame in every slot, which is -1 while the
+    slot is being written. A reader checks the sequence number again after
+    copying a frame, which detects frames that were overwritten meanwhile.
+
+    A SharedRing can be passed to a multiprocessing.Process, which attaches
+    to the same shared block.
+    """
+    def __init__(self, shape, dtype=np.float32, n_slots=4, name=None,
+                 signal=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_slots = n_slots
+        header_bytes = 8 * (_HEADER + n_slots)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._owner = name is None
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=header_bytes + n_slots * frame_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.counters = np.ndarray((_HEADER + n_slots,), dtype=np.int64,
+                                   buffer=self.shm.buf)
+        self.frames = np.ndarray((n_slots,) + self.shape, dtype=self.dtype,
+                                 buffer=self.shm.buf, offset=header_bytes)
+        if self._owner:
+            self.counters[:_HEADER] = 0
+            self.counters[_HEADER:] = -1
+        self._signal = signal if signal is not None \
+            else multiprocessing.Semaphore(0)
+
+    def __reduce__(self):
+        return (SharedRing, (self.shape, self.dtype, self.n_slots,
+                             self.shm.name, self._signal))
+
+    @property
+    def written(self):
+        return int(self.counters[_WRITTEN])
+
+    @property
+    def read_count(self):
+        return int(self.counters[_READ])
+
+    @property
+    def dropped(self):
+        return int(self.counters[_DROPPED])
+
+    def write(self, frame):
+        """Copies a frame into the next slot and wakes up the reader"""
+        seq = int(self.counters[_WRITTEN])
+        slot = seq % self.n_slots
+        self.counters[_HEADER + slot] = -1
+        np.copyto(self.frames[slot], frame, casting='unsafe')
+        self.counters[_HEADER + slot] = seq
+        self.counters[_WRITTEN] = seq + 1
+        self._signal.release()
+
+    def read(self, out, timeout=None, newest=False):
+        """Copies the next frame into ``out``
+
+        With ``newest`` every frame but the most recent one is skipped,
+        otherwise frames are read in order and only the frames that were
+        already overwritten are skipped. Skipped frames count as dropped.
+
+        Returns the sequence number of the frame, or None after ``timeout``.
+        """
+        next_seq = int(self.counters[_READ])
+        while int(self.counters[_WRITTEN]) <= next_seq:
+            if not self._signal.acquire(timeout=timeout):
+                return None
+        written = int(self.counters[_WRITTEN])
+        # The slot after the newest frame may be in the middle of a write
+        oldest = written - self.n_slots + 1
+        seq = written - 1 if newest else max(next_seq, oldest)
+        slot = seq % self.n_slots
+        np.copyto(out, self.frames[slot])
+        if self.counters[_HEADER + slot] != seq:
+            # Overwritten while it was copied
+            self.counters[_DROPPED] += seq - next_seq + 1
+            self.counters[_READ] = seq + 1
+            return self.read(out, timeout, newest)
+        self.counters[_DROPPED] += seq - next_seq
+        self.counters[_READ] = seq + 1
+        return seq
+
+    def close(self):
+        """Detaches from the shared block, the creator also frees it"""
+        del self.counters, self.frames
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _init_child(settings):
+    """Applies the parent's config module settings in a child process"""
+    # The parent handles Ctrl+C and stops the children
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+
+def _capture_main(settings, audio, stop_event, device):
+    _init_child(settings)
+    from audio.microphone import AudioInputProcess
+    source = AudioInputProcess(args=(audio.write, device, lambda: None))
+    source.daemon = True
+    source.start()
+    stop_event.wait()
+    source.stop()
+    source.join(1.0)
+
+
+def _processing_main(settings, mode, audio, pixels, stop_event):
+    _init_child(settings)
+    from visualizer import effects
+    from visualizer.processor import Processor
+
+    class Parent:
+        visualization_effect = effects.create(mode)
+
+    processor = Processor(Parent())
+    frame = np.empty(audio.shape, dtype=audio.dtype)
+    previous = None
+    while not stop_event.is_set():
+        if audio.read(frame, timeout=0.1) is None:
+            continue
+        output = processor.process(frame)
+        # Frames repeated under load are not sent again
+        if output is not previous:
+            pixels.write(output)
+            previous = output
+
+
+def _output_main(settings, pixels, stop_event, record):
+    _init_child(settings)
+    from output import led
+    from visualizer import metrics
+    led.setup()
+    if record is not None:
+        from output.recording import FrameRecorder
+        led.recorder = FrameRecorder(record, config.N_PIXELS)
+    frame = np.empty(pixels.shape, dtype=pixels.dtype)
+    while not stop_event.is_set():
+        if pixels.read(frame, timeout=0.1, newest=True) is None:
+            continue
+        led.pixels = frame
+        led.update()
+        metrics.stats.frame()
+        if config.DISPLAY_FPS:
+            metrics.stats.report()
+    # Turn all pixels off
+    led.pixels = np.tile(0, (3, config.N_PIXELS))
+    led.update()
+    if led.recorder is not None:
+        led.recorder.close()
+
+
+class ProcessPipeline:
+    """Runs capture, processing and output in three separate processes
+
+    Every stage gets its own interpreter and therefore its own core. Audio
+    frames and pixel frames are handed over through SharedRings instead of
+    pickled queues. The processing stage reads every audio frame in order,
+    the output stage always sends the newest pixel frame.
+
+    The children are started with the 'spawn' method and receive a copy of
+    the config module settings at start time. Runtime changes in the parent,
+    such as dsp.reconfigure() or led.recorder, do not reach them. The
+    output process owns the strip and switches it off when it stops. It
+    also appends every frame it sends to the recording at ``record`` when
+    that is given.
+    """
+    def __init__(self, mode='spectrum', device=None, n_slots=8, record=None):
+        self.mode = mode
+        self.device = device
+        self.record = record
+        self.n_slots = n_slots
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = []
+        self._rings = []
+        self._stop_event = None
+
+    def start(self):
+        """Starts all stages, restarting them if they were stopped"""
+        if self.is_alive():
+            return
+        self.stop()
+        ctx = self._context
+        samples_per_frame = int(config.MIC_RATE / config.FPS)
+        audio = SharedRing((samples_per_frame,), np.float32, self.n_slots,
+                           signal=ctx.Semaphore(0))
+        pixels = SharedRing((3, config.N_PIXELS), np.float64, self.n_slots,
+                            signal=ctx.Semaphore(0))
+        self._rings = [audio, pixels]
+        self._stop_event = ctx.Event()
+        settings = dict((name, getattr(config, name)) for name in dir(config)
+                        if name.isupper())
+        self._processes = [
+            ctx.Process(target=_capture_main, name='capture',
+                        args=(settings, audio, self._stop_event,
+                              self.device)),
+            ctx.Process(target=_processing_main, name='processing',
+                        args=(settings, self.mode, audio, pixels,
+                              self._stop_event)),
+            ctx.Process(target=_output_main, name='output',
+                        args=(settings, pixels, self._stop_event,
+                              self.record)),
+        ]
+        for process in self._processes:
+            process.daemon = True
+            process.start()
+
+    def stop(self, timeout=None):
+        """Stops all stages and waits up to ``timeout`` seconds for each"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+
+    def is_alive(self):
+        return any(process.is_alive() for process in self._processes)
+
+    def stats(self):
+        """Returns the frame counters of all stages"""
+        if not self._rings:
+            return {}
+        audio, pixels = self._rings
+        return {
+            'captured': audio.written,
+            'processed': pixels.written,
+            'shown': pixels.read_count - pixels.dropped,
+            'dropped_audio': audio.dropped,
+            'dropped_pixels': pixels.dropped,
+        }
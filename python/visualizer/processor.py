@@ -1,119 +1,196 @@
 from __future__ import division, print_function
 
-import time
-
 import numpy as np
-from scipy.ndimage.filters import gaussian_filter1d
 
 from output import led
-from audio import dsp, microphone
+from audio import dsp
 from settings import config
-from visualizer.effects import spectrum
+from visualizer import effects, metrics
+from visualizer.plots import PlotBuffer
+from visualizer.scheduler import QualityScheduler
 
 
 class Processor():
-    _time_prev = time.time() * 1000.0
-    """The previous time that the frames_per_second() function was called"""
-
-    _fps = dsp.ExpFilter(val=config.FPS, alpha_decay=0.2, alpha_rise=0.2)
-    """The low-pass filter used to estimate frames-per-second"""
-
-    # Number of audio samples to read every time frame
-    samples_per_frame = int(config.MIC_RATE / config.FPS)
-
-    # Array containing the rolling audio sample window
-    y_roll = np.random.rand(config.N_ROLLING_HISTORY, samples_per_frame) / 1e16
-
-    fft_plot_filter = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
-                                    alpha_decay=0.5, alpha_rise=0.99)
-    mel_gain = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
-                             alpha_decay=0.01, alpha_rise=0.99)
-    mel_smoothing = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
-                                  alpha_decay=0.5, alpha_rise=0.99)
-    volume = dsp.ExpFilter(config.MIN_VOLUME_THRESHOLD,
-                           alpha_decay=0.02, alpha_rise=0.02)
-    fft_window = np.hamming(int(config.MIC_RATE / config.FPS)
-                            * config.N_ROLLING_HISTORY)
-    prev_fps_update = time.time()
-
-
     def __init__(self, parent):
         self.parent = parent
+        # Every processor smooths its own spectrum, filters are not shared
+        self.fft_plot_filter = dsp.ExpFilter(
+            np.tile(1e-1, config.N_FFT_BINS), alpha_decay=0.5, alpha_rise=0.99)
+        self.mel_gain = dsp.ExpFilter(1e-1, alpha_decay=0.01, alpha_rise=0.99)
+        self.mel_smoothing = dsp.ExpFilter(
+            np.tile(1e-1, config.N_FFT_BINS), alpha_decay=0.5, alpha_rise=0.99)
+        self.volume = dsp.ExpFilter(config.MIN_VOLUME_THRESHOLD,
+                                    alpha_decay=0.02, alpha_rise=0.02)
         self.visualization_effect = self.parent.visualization_effect
-
-    def frames_per_second(self):
-        """Return the estimated frames per second
-
-        Returns the current estimate for frames-per-second (FPS).
-        FPS is estimated by measured the amount of time that has elapsed since
-        this function was previously called. The FPS estimate is low-pass filtered
-        to reduce noise.
-
-        This function is intended to be called one time for every iteration of
-        the program's main loop.
+        self.state = None
+        """DSP snapshot that the buffers are currently sized for"""
+        self.analyzer = None
+        self.y_roll = None
+        self.mel = None
+        """Copy of the most recent mel spectrum, None while the input is
+        silent"""
+        self.zones = self._create_zones()
+        """(pixels, effect) pairs of config.ZONES, empty for a single zone"""
+        self.scheduler = QualityScheduler()
+        self.plots = PlotBuffer()
+        """Newest smoothed mel spectrum and pixels, for the GUI thread"""
+        self._output = None
+        self._shown = None
+        self._configure(dsp.snapshot())
+        if config.METRICS_PORT is not None:
+            metrics.stats.serve(config.METRICS_PORT)
+
+    @staticmethod
+    def _create_zones():
+        """Creates an effect for every zone in config.ZONES"""
+        zones = []
+        if config.ZONES is None:
+            return zones
+        start = 0
+        for name, n_pixels in config.ZONES:
+            zones.append((slice(start, start + n_pixels),
+                          effects.create(name, n_pixels)))
+            start += n_pixels
+        assert start == config.N_PIXELS, \
+            'Zones have {} pixels, expected {}'.format(start, config.N_PIXELS)
+        return zones
+
+    def _configure(self, state):
+        """Resizes the audio buffers and filters to match a new DSP snapshot
+
+        Runs between two frames. The newest audio of the old rolling window
+        is carried over, so a change of the history length is seamless.
+        """
+        self.state = state
+        self.analyzer = state.analyzer
+        # Number of audio samples to read every time frame
+        self.samples_per_frame = state.samples_per_frame
+        # Rolling audio sample window
+        size = state.samples_per_frame * state.n_history
+        if self.y_roll is None or self.y_roll.size != size:
+            y_roll = dsp.AudioHistory(state.n_history,
+                                      state.samples_per_frame, fill=1e-16)
+            if self.y_roll is not None:
+                y_roll.push(self.y_roll.window()[-size:])
+            self.y_roll = y_roll
+        if len(self.mel_smoothing.value) != state.n_bins:
+            self.mel_smoothing = dsp.ExpFilter(
+                np.tile(1e-1, state.n_bins), alpha_decay=0.5, alpha_rise=0.99)
+        self._mel_blur = np.zeros(state.n_bins)
+
+    def process(self, audio_samples):
+        """Transforms a frame of audio into pixel values for the LED strip
+
+        Parameters
+        ----------
+        audio_samples : np.array
+            The newest samples_per_frame audio samples, normalized to
+            values between -1 and 1.
 
         Returns
         -------
-        fps : float
-            Estimated frames-per-second. This value is low-pass filtered
-            to reduce noise.
+        output : np.array
+            (3, N_PIXELS) array of pixel values.
         """
-        time_now = time.time() * 1000.0
-        dt = time_now - self._time_prev
-        self._time_prev = time_now
-        if dt == 0.0:
-            return self._fps.value
-        return self._fps.update(1000.0 / dt)
-
-
-
-    def __call__(self, audio_samples):
+        start = metrics.clock()
         self.visualization_effect = self.parent.visualization_effect
-        # Normalize samples between 0 and 1
-        y = audio_samples / 2.0**15
-        # Construct a rolling window of audio samples
-        self.y_roll[:-1] = self.y_roll[1:]
-        self.y_roll[-1, :] = np.copy(y)
-        y_data = np.concatenate(self.y_roll, axis=0).astype(np.float32)
-
-        vol = np.max(np.abs(y_data))
+        state = dsp.snapshot()
+        if state is not self.state:
+            self._configure(state)
+        # Add the samples to the rolling window
+        self.y_roll.push(audio_samples)
+        y_data = self.y_roll.window()
+
+        vol = self.y_roll.peak()
         if vol < config.MIN_VOLUME_THRESHOLD:
             print('No audio input. Volume below threshold. Volume:', vol)
-            led.pixels = np.tile(0, (3, config.N_PIXELS))
-            led.update()
+            self.mel = None
+            self._output = np.tile(0, (3, config.N_PIXELS))
+        elif self.scheduler.skip() and self._output is not None:
+            # Repeat the previous frame, it is not sent again
+            pass
         else:
             # Transform audio input into the frequency domain
-            N = len(y_data)
-            N_zeros = 2**int(np.ceil(np.log2(N))) - N
-            # Pad with zeros until the next power of two
-            y_data *= self.fft_window
-            y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-            YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
+            t = metrics.clock()
+            YS = state.analyzer(y_data)
+            t = metrics.stats.lap('fft', t)
             # Construct a Mel filterbank from the FFT data
-            mel = np.atleast_2d(YS).T * dsp.mel_y.T
-            # Scale data to values more suitable for visualization
-            # mel = np.sum(mel, axis=0)
-            mel = np.sum(mel, axis=0)
-            mel = mel**2.0
-            # Gain normalization
-            self.mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
-            mel /= self.mel_gain.value
-            mel = self.mel_smoothing.update(mel)
-            # Map filterbank output onto LED strip
-            output = self.visualization_effect(mel) 
+            mel = state.mel_bank(YS)
+            metrics.stats.lap('mel', t)
+            self._output = self.render(mel)
+        self.scheduler.add(metrics.clock() - start, 'processing')
+        return self._output
+
+    def render(self, mel):
+        """Normalizes a mel spectrum and maps it onto the LED strip
+
+        Parameters
+        ----------
+        mel : np.array
+            Mel filterbank output for one frame of audio.
+
+        Returns
+        -------
+        output : np.array
+            (3, N_PIXELS) array of pixel values.
+        """
+        self.visualization_effect = self.parent.visualization_effect
+        t = metrics.clock()
+        # Scale data to values more suitable for visualization
+        mel = mel**2.0
+        # Gain normalization
+        blur = self.scheduler.blur
+        if blur:
+            self.mel_gain.update(np.max(dsp.gaussian_filter1d(
+                mel, sigma=1.0, out=self._mel_blur)))
+        else:
+            self.mel_gain.update(np.max(mel))
+        mel /= self.mel_gain.value
+        mel = self.mel_smoothing.update(mel)
+        # The filter updates the same array in place on the next frame, while
+        # the output stage may still plot this one
+        self.mel = np.copy(mel)
+        t = metrics.stats.lap('gain', t)
+        # Map filterbank output onto LED strip, every zone renders into its
+        # own range of the output frame
+        output = np.empty((3, config.N_PIXELS))
+        zones = self.zones or [(slice(None), self.visualization_effect)]
+        for pixels, effect in zones:
+            if effect.n_bins != len(mel):
+                effect.resize(len(mel))
+            effect.blur = blur
+            effect.render(mel, output[:, pixels])
+        metrics.stats.lap('effect', t)
+        return output
+
+    def show(self, output, mel=None):
+        """Displays pixel values on the LED strip and the GUI plots
+
+        ``mel`` is the mel spectrum of the frame, the ``mel`` attribute
+        right after process() returned it. The GUI plots are not updated
+        without it. A frame repeated by process() under heavy load is not
+        sent again.
+        """
+        start = metrics.clock()
+        if output is not self._shown:
+            self._shown = output
             led.pixels = output
             led.update()
-            if config.USE_GUI:
-                # Plot filterbank output
-                x = np.linspace(config.MIN_FREQUENCY,
-                                config.MAX_FREQUENCY, len(mel))
-                self.parent.mel_curve.setData(x=x, y=self.fft_plot_filter.update(mel))
-                # Plot the color channels
-                self.parent.r_curve.setData(y=led.pixels[0])
-                self.parent.g_curve.setData(y=led.pixels[1])
-                self.parent.b_curve.setData(y=led.pixels[2])
+        if config.USE_GUI and mel is not None and self.scheduler.show_gui:
+            t = metrics.clock()
+            # The plot filter belongs to the thread calling show(), which may
+            # still receive frames of the previous mel bank after a change
+            if len(self.fft_plot_filter.value) != len(mel):
+                self.fft_plot_filter = dsp.ExpFilter(
+                    np.tile(1e-1, len(mel)), alpha_decay=0.5, alpha_rise=0.99)
+            # The GUI thread plots the newest frame on its own timer
+            self.plots.write(self.fft_plot_filter.update(mel), led.pixels)
+            metrics.stats.lap('gui', t)
+        self.scheduler.add(metrics.clock() - start, 'output')
+        metrics.stats.frame()
         if config.DISPLAY_FPS:
-            fps = self.frames_per_second()
-            if time.time() - 0.5 > self.prev_fps_update:
-                self.prev_fps_update = time.time()
-                print('FPS {:.0f} / {:.0f}'.format(fps, config.FPS))
+            metrics.stats.report()
+
+    def __call__(self, audio_samples):
+        output = self.process(audio_samples)
+        self.show(output, self.mel)
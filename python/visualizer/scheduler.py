@@ -0,0 +1,124 @@
+from __future__ import division, print_function
+
+import threading
+
+from audio import dsp
+from settings import config
+from visualizer import metrics
+
+
+class QualityScheduler:
+    """Trades visual quality for speed to keep up with the audio input
+
+    The time every pipeline stage spends on a frame is compared with the
+    frame period 1 / config.FPS. Each stage has its own smoothed load, which
+    only the thread running that stage updates. The stages run concurrently,
+    so the busier one limits the frame rate and sets the overall load. The
+    level is adjusted once per processed frame. When the load stays above
+    ``degrade_at``, the quality level goes up by one step, at most once
+    every ``hold`` seconds. When it stays below ``restore_at`` for
+    ``restore_hold`` seconds, the level goes back down by one step:
+
+        0  full quality
+        1  the GUI plots are not updated
+        2  the rolling audio history is halved
+        3  the effects and the gain normalization skip their blurs
+        4  only every other frame is rendered and sent to the LED strip
+
+    Every level includes the savings of the levels below it. The current
+    level is published as the 'quality_level' metric. The history length is
+    changed by a helper thread, so the DSP snapshot is never rebuilt on a
+    pipeline thread.
+    """
+    LEVELS = ('full', 'no_gui', 'short_history', 'no_blur', 'half_rate')
+    """Names of the quality levels"""
+
+    STAGES = ('processing', 'output')
+    """Pipeline stages whose load is tracked"""
+
+    def __init__(self, degrade_at=0.8, restore_at=0.4, hold=1.0,
+                 restore_hold=5.0, max_level=None):
+        assert 0.0 < restore_at < degrade_at, 'Invalid load thresholds'
+        self.degrade_at = degrade_at
+        self.restore_at = restore_at
+        self.hold = hold
+        self.restore_hold = restore_hold
+        self.max_level = len(self.LEVELS) - 1 if max_level is None \
+            else max_level
+        self.level = 0
+        self.loads = dict((stage, dsp.ExpFilter(0.0, alpha_decay=0.05,
+                                                alpha_rise=0.3))
+                          for stage in self.STAGES)
+        """Smoothed fraction of the frame period every stage spends working"""
+        self._processed = 0
+        self._history = None
+        self._changed = self._busy = metrics.clock()
+        metrics.stats.set('quality_level', self.level)
+
+    @property
+    def load(self):
+        """Smoothed load of the busiest stage"""
+        return max(load.value for load in self.loads.values())
+
+    @property
+    def show_gui(self):
+        """Whether the GUI plots should be updated"""
+        return self.level < 1
+
+    @property
+    def blur(self):
+        """Whether the effects and the gain normalization should blur"""
+        return self.level < 3
+
+    def skip(self):
+        """Counts a processed frame, returns whether to skip rendering it"""
+        self._processed += 1
+        return self.level >= 4 and self._processed % 2 == 0
+
+    def add(self, seconds, stage='processing'):
+        """Records the time ``stage`` spent on one frame
+
+        Must be called from the thread running the stage. A processed frame
+        also adjusts the quality level.
+        """
+        self.loads[stage].update(seconds * config.FPS)
+        if stage == 'processing':
+            self._adjust()
+
+    def _adjust(self):
+        now = metrics.clock()
+        load = self.load
+        if not config.ADAPTIVE_QUALITY:
+            if self.level != 0:
+                self._set_level(0, now)
+            return
+        if load >= self.restore_at:
+            self._busy = now
+        if load > self.degrade_at and self.level < self.max_level:
+            if now - self._changed >= self.hold:
+                self._set_level(self.level + 1, now)
+        elif self.level > 0 and \
+                now - max(self._busy, self._changed) >= self.restore_hold:
+            self._set_level(self.level - 1, now)
+
+    def _set_level(self, level, now):
+        previous, self.level = self.level, level
+        self._changed = now
+        metrics.stats.set('quality_level', level)
+        if previous < 2 <= level:
+            self._history = config.N_ROLLING_HISTORY
+            self._reconfigure(N_ROLLING_HISTORY=max(1, self._history // 2))
+        elif level < 2 <= previous and self._history is not None:
+            self._reconfigure(N_ROLLING_HISTORY=self._history)
+            self._history = None
+        if config.DISPLAY_FPS:
+            print('Quality level {} ({}), load {:.0%}'.format(
+                level, self.LEVELS[level], self.load))
+
+    @staticmethod
+    def _reconfigure(**settings):
+        # The pipeline picks the new snapshot up once it is published
+        thread = threading.Thread(target=dsp.reconfigure, kwargs=settings,
+                                  name='reconfigure')
+        thread.daemon = True
+        thread.start()